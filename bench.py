@@ -0,0 +1,387 @@
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Offline load test: runs the real handlers from main.py against local stand-ins
+# for the Telegram Bot API, the RSS feed and the Groq (OpenAI compatible) API.
+#
+#   python bench.py                          # every workload
+#   python bench.py latest ai --users 200    # selected workloads
+#   python bench.py fanout --chats 10000 --send-rate 1000 --tg-429-rate 0.01
+#   python bench.py parse --parse-items 20000
+
+PROGRESS_CURSOR = " ▌"
+PLACEHOLDER_PREFIX = "🤖"
+
+# Fake Telegram Bot API
+
+tg_lock = threading.Lock()
+tg_calls = {} # method -> count
+tg_sent_at = {} # chat_id -> time of the last sendMessage/sendPhoto
+tg_answered_at = {} # chat_id -> time of the last answer that wasn't a placeholder or progress edit
+tg_message_ids = [0]
+
+class FakeTelegram(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0
+    rate_429 = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api()
+
+    def do_POST(self):
+        self.handle_api()
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_api(self):
+        url = urllib.parse.urlsplit(self.path)
+        method = url.path.rsplit("/", 1)[-1]
+        params = dict(urllib.parse.parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if body and self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            params.update(urllib.parse.parse_qsl(body.decode("utf-8")))
+
+        if method == "getUpdates":
+            time.sleep(0.5)
+            return self.reply(200, {"ok": True, "result": []})
+        if method == "getMe":
+            return self.reply(200, {"ok": True, "result": {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}})
+
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rate_429 and random.random() < self.rate_429:
+            return self.reply(429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                    "parameters": {"retry_after": 1}})
+
+        now = time.time()
+        chat_id = int(params.get("chat_id", 0) or 0)
+        text = params.get("text", "")
+        with tg_lock:
+            tg_calls[method] = tg_calls.get(method, 0) + 1
+            tg_message_ids[0] += 1
+            message_id = tg_message_ids[0]
+            if method in ("sendMessage", "sendPhoto"):
+                tg_sent_at[chat_id] = now
+            if text and not text.endswith(PROGRESS_CURSOR) and not text.startswith(PLACEHOLDER_PREFIX):
+                tg_answered_at[chat_id] = now
+
+        if method in ("sendMessage", "editMessageText", "sendPhoto"):
+            message = {"message_id": int(params.get("message_id", message_id)), "date": int(now),
+                       "chat": {"id": chat_id, "type": "private"}}
+            if method == "sendPhoto":
+                message["photo"] = [{"file_id": f"file-{message_id}", "file_unique_id": f"u{message_id}",
+                                     "width": 1024, "height": 1024}]
+            else:
+                message["text"] = text
+            return self.reply(200, {"ok": True, "result": message})
+        return self.reply(200, {"ok": True, "result": True})
+
+# Fake RSS feed
+
+class FakeRss(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    feed = b""
+    etag = '"bench"'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(self.feed)))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(self.feed)
+
+def synthetic_feed(items):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Bench News</title>']
+    for i in range(items):
+        published = time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(time.time() - i * 600))
+        parts.append(
+            f"<item><title>Synthetic anime headline number {i} about a new season announcement</title>"
+            f"<link>https://news.example/article/{i}</link><guid>bench-{i}</guid>"
+            f"<pubDate>{published}</pubDate>"
+            f"<description>Body text for article {i}. " + "Lorem ipsum dolor sit amet. " * 20 + "</description></item>"
+        )
+    parts.append("</channel></rss>")
+    return "".join(parts).encode("utf-8")
+
+# Fake OpenAI compatible chat completions
+
+class FakeGroq(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    tokens = 100
+    token_delay = 0.01
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+        words = [f"word{i} " for i in range(self.tokens)]
+        if not request.get("stream"):
+            time.sleep(self.token_delay * self.tokens)
+            body = json.dumps({
+                "id": "bench", "object": "chat.completion", "created": int(time.time()), "model": request["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": self.tokens, "total_tokens": 10 + self.tokens}
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for word in words:
+            time.sleep(self.token_delay)
+            chunk = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": request["model"],
+                     "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+            self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+def start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:%d" % server.server_address[1]
+
+# Workloads
+
+def make_message(chat_id, text):
+    from telebot import types
+    return types.Message.de_json({
+        "message_id": 1, "date": int(time.time()), "text": text,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"user{chat_id}"}
+    })
+
+def make_call(chat_id, data):
+    from telebot import types
+    return types.CallbackQuery.de_json({
+        "id": str(chat_id), "chat_instance": "bench", "data": data,
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+        "message": {"message_id": 1, "date": int(time.time()), "text": "menu", "chat": {"id": chat_id, "type": "private"}}
+    })
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def report(name, count, elapsed, latencies, extra=None):
+    result = {
+        "workload": name,
+        "requests": count,
+        "seconds": round(elapsed, 3),
+        "throughput_per_sec": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }
+    result.update(extra or {})
+    print(" ".join(f"{k}={v}" for k, v in result.items()))
+    return result
+
+def run_calls(handler, args_list, concurrency):
+    def call(args):
+        start = time.perf_counter()
+        handler(*args)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(call, args_list))
+    return time.perf_counter() - start, latencies
+
+def bench_latest(main, args):
+    jobs = [(make_message(1000 + i % args.users, "/latest"),) for i in range(args.users * args.repeat)]
+    elapsed, latencies = run_calls(main.latest_cmd, jobs, args.concurrency)
+    return report("latest", len(jobs), elapsed, latencies)
+
+def bench_random(main, args):
+    jobs = [(make_call(2000 + i % args.users, "menu_random"),) for i in range(args.users * args.repeat)]
+    elapsed, latencies = run_calls(main.callback_router, jobs, args.concurrency)
+    return report("random", len(jobs), elapsed, latencies)
+
+def wait_for(done, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline and not done():
+        time.sleep(0.05)
+
+def bench_ai(main, args):
+    # End-to-end: from the /ai message to the complete answer being shown
+    chats = [300000 + i for i in range(args.ai_burst)]
+    submitted = {}
+    start = time.perf_counter()
+    for i, chat_id in enumerate(chats):
+        submitted[chat_id] = time.time()
+        main.ai_cmd(make_message(chat_id, f"/ai bench question {i % args.ai_distinct}"))
+
+    def finished():
+        with tg_lock:
+            return all(chat_id in tg_answered_at for chat_id in chats)
+    wait_for(finished, args.timeout)
+    elapsed = time.perf_counter() - start
+
+    with tg_lock:
+        latencies = [tg_answered_at[c] - submitted[c] for c in chats if c in tg_answered_at]
+    return report("ai", len(chats), elapsed, latencies, {
+        "completed": len(latencies),
+        "ai_cache_hits": main.ai_cache_stats['hits'] + main.ai_cache_stats['fuzzy_hits']
+    })
+
+def bench_fanout(main, args):
+    # Delay from the start of the fan-out until each subscriber got the push
+    chats = [-1000000 - i for i in range(args.chats)]
+    main.auto_update_chats.update(chats)
+    entries = main.parse_feed(synthetic_feed(1))
+
+    start_wall = time.time()
+    start = time.perf_counter()
+    main.fan_out(entries)
+    elapsed = time.perf_counter() - start
+
+    with tg_lock:
+        latencies = [tg_sent_at[c] - start_wall for c in chats if c in tg_sent_at]
+    main.auto_update_chats.difference_update(chats)
+    return report("fanout", len(chats), elapsed, latencies, {"delivered": len(latencies)})
+
+def measure_parse(name, parse, content, args):
+    latencies = []
+    for _ in range(args.parse_repeat):
+        start = time.perf_counter()
+        items = len(parse(content))
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    parse(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return report(name, len(latencies), sum(latencies), latencies, {
+        "items": items,
+        "peak_alloc_mb": round(peak / 1024 / 1024, 1)
+    })
+
+def bench_parse(main, args):
+    # One large feed through feedparser, the streaming parser over the whole feed,
+    # and the streaming parser with the bot's FEED_MAX_ITEMS cut-off
+    content = synthetic_feed(args.parse_items)
+    return [
+        measure_parse("parse_feedparser", lambda c: main.feedparser.parse(c).entries, content, args),
+        measure_parse("parse_stream", lambda c: main.parse_rss(c, limit=args.parse_items), content, args),
+        measure_parse("parse_stream_first_n", main.parse_rss, content, args)
+    ]
+
+WORKLOADS = {
+    "latest": bench_latest,
+    "random": bench_random,
+    "ai": bench_ai,
+    "fanout": bench_fanout,
+    "parse": bench_parse
+}
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline load test for the anime news bot")
+    parser.add_argument("workloads", nargs="*", help="workloads to run: " + ", ".join(WORKLOADS) + " (default: all)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5, help="requests per user for latest/random")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--feed-items", type=int, default=500)
+    parser.add_argument("--ai-burst", type=int, default=200)
+    parser.add_argument("--ai-distinct", type=int, default=20, help="distinct prompts in the /ai burst")
+    parser.add_argument("--ai-tokens", type=int, default=100)
+    parser.add_argument("--ai-token-delay", type=float, default=0.01)
+    parser.add_argument("--chats", type=int, default=10000, help="subscribers for the fan-out")
+    parser.add_argument("--send-rate", type=float, default=1000, help="global Telegram send rate (the real limit is 30)")
+    parser.add_argument("--tg-latency", type=float, default=0.0, help="seconds added to every Bot API call")
+    parser.add_argument("--tg-429-rate", type=float, default=0.0, help="fraction of Bot API calls answered with 429")
+    parser.add_argument("--parse-items", type=int, default=5000, help="items in the feed for the parse benchmark")
+    parser.add_argument("--parse-repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error("unknown workload: " + ", ".join(unknown))
+
+    FakeTelegram.latency = args.tg_latency
+    FakeTelegram.rate_429 = args.tg_429_rate
+    FakeRss.feed = synthetic_feed(args.feed_items)
+    FakeGroq.tokens = args.ai_tokens
+    FakeGroq.token_delay = args.ai_token_delay
+
+    telegram_url = start_server(FakeTelegram)
+    rss_url = start_server(FakeRss)
+    groq_url = start_server(FakeGroq)
+
+    # main.py reads its configuration at import time
+    os.environ["TOKEN"] = "123456:bench"
+    os.environ["GROQ_API_KEY"] = "bench"
+    os.environ["GROQ_BASE_URL"] = groq_url + "/v1"
+    os.environ["RSS_URLS"] = rss_url + "/rss.xml"
+    os.environ["STATE_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="animebot-bench-"), "state.db")
+    os.environ.pop("WEBHOOK_URL", None)
+    os.environ["BOT_RUNTIME"] = "threaded"
+    os.environ["ANIMEBOT_AUTOSTART"] = "0"
+    from telebot import apihelper
+    apihelper.API_URL = telegram_url + "/bot{0}/{1}"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    main.telegram_global_bucket = main.TokenBucket(args.send_rate, args.send_rate)
+    main.start()
+
+    results = []
+    for name in args.workloads or list(WORKLOADS):
+        result = WORKLOADS[name](main, args)
+        results.extend(result if isinstance(result, list) else [result])
+    print("telegram calls: " + json.dumps(tg_calls, sort_keys=True))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "telegram_calls": tg_calls}, f, indent=2)
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,20 +1,55 @@
 import requests
 import os
+import asyncio
 import random
 import threading
+import queue
 import time
 import feedparser
+import email.utils
+import xml.etree.ElementTree as ET
 import json
+import sqlite3
+import atexit
+import fcntl
+import signal
+import calendar
+import functools
+from contextlib import contextmanager
 import urllib.parse
-from flask import Flask
+import hashlib
+import re
+import math
+import heapq
+import html
+import unicodedata
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from flask import Flask, request
+from requests.adapters import HTTPAdapter
 from telebot import TeleBot, types
-from openai import OpenAI
+from telebot import apihelper
+from telebot import asyncio_helper
+from telebot.apihelper import ApiTelegramException
+from telebot.async_telebot import AsyncTeleBot
 
 # AI Config (Render/Groq Optimized)
-openai_client = OpenAI(
-    api_key=os.environ.get("GROQ_API_KEY"),
-    base_url="https://api.groq.com/openai/v1"
-)
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+# Built on first use: importing openai is a large part of cold start
+openai_client = None
+openai_client_lock = threading.Lock()
+
+def get_openai_client():
+    global openai_client
+    with openai_client_lock:
+        if openai_client is None:
+            from openai import OpenAI
+            openai_client = OpenAI(
+                api_key=os.environ.get("GROQ_API_KEY"),
+                base_url=GROQ_BASE_URL
+            )
+    return openai_client
 
 # Bot Config
 BOT_TOKEN = os.environ.get("TOKEN")
@@ -22,45 +57,431 @@ if not BOT_TOKEN:
     print("ERROR: TOKEN not found in environment variables.")
     os._exit(1)
 
-bot = TeleBot(BOT_TOKEN)
+# Webhook mode: set WEBHOOK_URL to the public URL of /webhook and Telegram pushes
+# updates to the Flask app instead of the bot polling (always runs threaded handlers).
+# WEBHOOK_SECRET is required then, otherwise anyone could post forged updates
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    print("ERROR: WEBHOOK_SECRET must be set when WEBHOOK_URL is used.")
+    os._exit(1)
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", "8"))
+DISPATCH_QUEUE_MAX = 200
+
+# In webhook mode handlers run inline on the dispatcher workers, which keep each chat in order
+bot = TeleBot(BOT_TOKEN, threaded=not WEBHOOK_URL)
 OWNER_ID = int(os.environ.get("OWNER_ID", "0"))
 RSS_URL = "https://www.animenewsnetwork.com/all/rss.xml"
+# Extra feeds can be added as a comma separated list in RSS_URLS
+RSS_URLS = [u.strip() for u in os.environ.get("RSS_URLS", RSS_URL).split(",") if u.strip()]
+SEEN_INDEX_MAX = 5000
+MAX_NEW_PER_POLL = 10
+RANDOM_CURSORS_MAX = 50000
+# /search results stay pageable for this long
+SEARCH_SESSION_TTL_SEC = 24 * 3600
+# Entries kept per feed; the streaming parser stops reading once it has this many
+FEED_MAX_ITEMS = int(os.environ.get("FEED_MAX_ITEMS", "200"))
+# Headline translation: one Groq call translates a batch of titles into every
+# language in use; results are cached per (entry guid, language)
+TRANSLATION_MODEL = os.environ.get("TRANSLATION_MODEL", "llama-3.1-8b-instant")
+TRANSLATION_TIMEOUT_SEC = 10
+TRANSLATION_BATCH_MAX = 20
+TRANSLATIONS_MAX = 20000
+TRANSLATION_QUEUE_MAX = 10
+TRANSLATION_FAILURE_BACKOFF_SEC = 60
+DELIVERY_WORKERS = int(os.environ.get("DELIVERY_WORKERS", "8"))
+# Telegram transport (Telegram allows ~30 msg/s overall and ~1 msg/s per chat)
+TELEGRAM_POOL_SIZE = int(os.environ.get("TELEGRAM_POOL_SIZE", "32"))
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_CHAT_BUCKETS_MAX = 10000
+TELEGRAM_MAX_RETRIES = 3
 SEND_SEPARATE_MESSAGES = False
 AUTO_UPDATE_INTERVAL_SEC = 120
+# "threaded" (TeleBot polling) or "async" (AsyncTeleBot on one event loop)
+BOT_RUNTIME = os.environ.get("BOT_RUNTIME", "threaded")
 NL = "\n"
 
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Metrics: Prometheus text format on /metrics. Updating a counter or histogram is a
+# dict lookup and a few additions under one lock, cheap enough to leave on.
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+metrics_lock = threading.Lock()
+metric_counters = {} # (name, labels) -> value
+metric_histograms = {} # (name, labels) -> {'buckets', 'counts', 'sum', 'count'}
+
+def inc_metric(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        metric_counters[key] = metric_counters.get(key, 0) + amount
+
+def observe_metric(name, value, buckets=METRIC_BUCKETS, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        histogram = metric_histograms.get(key)
+        if histogram is None:
+            histogram = metric_histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram['counts'][i] += 1
+                break
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+def count_error(kind):
+    inc_metric("animebot_errors_total", type=kind)
+
+@contextmanager
+def timed(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_metric(name, time.perf_counter() - start, **labels)
+
+def instrumented(command):
+    # Records handler duration for sync and async handlers alike
+    def decorate(handler):
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def run_async(*args):
+                with timed("animebot_handler_seconds", command=command):
+                    return await handler(*args)
+            return run_async
+
+        @functools.wraps(handler)
+        def run(*args):
+            with timed("animebot_handler_seconds", command=command):
+                return handler(*args)
+        return run
+    return decorate
+
+# Telegram transport: every outbound Bot API call goes through one keep-alive
+# connection pool, waits on the global and per-chat token buckets when it targets
+# a chat, and is retried after 429 (honouring retry_after), 5xx and connect errors.
+# AsyncTeleBot talks to aiohttp directly, so it gets the same buckets, retries and
+# metrics from async_send_telegram_request below
+telegram_session = requests.Session()
+telegram_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=TELEGRAM_POOL_SIZE))
+telegram_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=TELEGRAM_POOL_SIZE))
+telegram_global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+telegram_chat_buckets = OrderedDict() # chat_id -> TokenBucket, least recent first
+telegram_chat_buckets_lock = threading.Lock()
+
+def telegram_chat_bucket(chat_id):
+    with telegram_chat_buckets_lock:
+        bucket = telegram_chat_buckets.pop(chat_id, None) or TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        telegram_chat_buckets[chat_id] = bucket
+        while len(telegram_chat_buckets) > TELEGRAM_CHAT_BUCKETS_MAX:
+            telegram_chat_buckets.popitem(last=False)
+    return bucket
+
+def telegram_retry_after(response):
+    try:
+        return float(response.json().get("parameters", {}).get("retry_after", 1))
+    except Exception:
+        return 1.0
+
+def send_telegram_request(method, url, params=None, **kwargs):
+    api_method = url.rsplit("/", 1)[-1]
+    chat_id = params.get("chat_id") if params else None
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        if chat_id is not None:
+            telegram_global_bucket.acquire()
+            telegram_chat_bucket(chat_id).acquire()
+
+        with timed("animebot_telegram_api_seconds", method=api_method):
+            try:
+                response = telegram_session.request(method, url, params=params, **kwargs)
+            except requests.exceptions.ConnectionError:
+                count_error("telegram_network")
+                if attempt < TELEGRAM_MAX_RETRIES:
+                    time.sleep(0.5 * 2 ** attempt)
+                    continue
+                raise
+            except Exception:
+                count_error("telegram_network")
+                raise
+
+        if response.status_code != 200:
+            inc_metric("animebot_telegram_api_errors_total", method=api_method, code=str(response.status_code))
+        if attempt < TELEGRAM_MAX_RETRIES and api_method != "getUpdates":
+            if response.status_code == 429:
+                time.sleep(telegram_retry_after(response))
+                continue
+            if response.status_code >= 500:
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+        return response
+
+apihelper.CUSTOM_REQUEST_SENDER = send_telegram_request
+
+async def async_acquire(bucket):
+    while not bucket.try_acquire():
+        await asyncio.sleep(1 / bucket.rate)
+
+def telegram_retry_delay(status, attempt, retry_after=None):
+    # Seconds to wait before retrying a failed call, or None if it shouldn't be retried
+    if status == 429:
+        return float(retry_after or 1)
+    if status >= 500:
+        return 0.5 * 2 ** attempt
+    return None
+
+async_process_request = asyncio_helper._process_request
+
+async def async_send_telegram_request(token, url, method='get', params=None, files=None, **kwargs):
+    chat_id = params.get("chat_id") if params else None
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        if chat_id is not None:
+            await async_acquire(telegram_global_bucket)
+            await async_acquire(telegram_chat_bucket(chat_id))
+
+        can_retry = attempt < TELEGRAM_MAX_RETRIES and url != "getUpdates"
+        try:
+            with timed("animebot_telegram_api_seconds", method=url):
+                # aiohttp's helper pops fields from params, keep ours intact for a retry
+                return await async_process_request(token, url, method, dict(params) if params else params, files, **kwargs)
+        except asyncio_helper.ApiTelegramException as e:
+            inc_metric("animebot_telegram_api_errors_total", method=url, code=str(e.error_code))
+            delay = telegram_retry_delay(e.error_code, attempt, e.result_json.get("parameters", {}).get("retry_after"))
+            if not can_retry or delay is None:
+                raise
+        except asyncio_helper.ApiHTTPException as e:
+            inc_metric("animebot_telegram_api_errors_total", method=url, code=str(e.result.status))
+            delay = telegram_retry_delay(e.result.status, attempt)
+            if not can_retry or delay is None:
+                raise
+        except asyncio_helper.RequestTimeout:
+            count_error("telegram_network")
+            if not can_retry:
+                raise
+            delay = 0.5 * 2 ** attempt
+        await asyncio.sleep(delay)
+
+asyncio_helper._process_request = async_send_telegram_request
+
 # State
 auto_update_chats = set()
-last_seen_link = {}
-random_pools = {}
+seen_index = OrderedDict() # guid / content hash -> True, oldest first
+seen_index_lock = threading.Lock()
+random_cursors = OrderedDict() # chat_id -> {'seed', 'after'}, least recently used first
+random_cursors_lock = threading.Lock()
 error_stickers = []
 awaiting_stickers_from_owner = False
 chat_languages = {} # chat_id -> 'en', 'hi', 'ru', 'pt'
 bot_ratings = {} # user_id -> rating
 bot_users = set() # set of user_ids who used the bot
+ai_cache = OrderedDict() # (normalized query, lang) -> {'text', 'at'}, least recent first
+image_file_ids = OrderedDict() # normalized prompt -> {'file_id', 'hits'}, least recent first
+translations = OrderedDict() # (entry guid, lang) -> translated title, least recent first
+
+# Persistent state: every map above is mirrored into one SQLite table (WAL mode).
+# Updates only record the change in memory; a background writer flushes them in
+# batches, so each update is O(1) no matter how many users the bot has.
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "state.db")
+STATE_FLUSH_INTERVAL_SEC = 2
+pending_writes = {} # (map, key) -> value, None means delete
+pending_writes_lock = threading.Lock()
+state_db = None
+state_db_lock = threading.Lock()
+
+def open_state_db():
+    db = sqlite3.connect(STATE_DB_PATH, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS state (map TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, UNIQUE (map, key))")
+    # News archive for /search: one row per entry ever fetched plus an inverted index over it
+    db.execute("CREATE TABLE IF NOT EXISTS archive (id INTEGER PRIMARY KEY, guid TEXT NOT NULL UNIQUE, title TEXT NOT NULL, "
+               "link TEXT NOT NULL, published INTEGER NOT NULL, length INTEGER NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, doc INTEGER NOT NULL, tf INTEGER NOT NULL, "
+               "PRIMARY KEY (term, doc)) WITHOUT ROWID")
+    return db
+
+ARCHIVE_STATS_TTL_SEC = 30
+archive_docs = 0
+archive_total_length = 0
+archive_stats_at = 0
+
+def refresh_archive_stats():
+    # Collection size for BM25. Cached for ARCHIVE_STATS_TTL_SEC so searches don't
+    # scan the archive, yet still see entries other workers indexed
+    global archive_docs, archive_total_length, archive_stats_at
+    archive_docs, archive_total_length = state_db.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM archive").fetchone()
+    archive_stats_at = time.time()
+
+def state_set(map_name, key, value=True):
+    with pending_writes_lock:
+        pending_writes[(map_name, json.dumps(key))] = value
+
+def state_delete(map_name, key):
+    with pending_writes_lock:
+        pending_writes[(map_name, json.dumps(key))] = None
+
+def flush_state():
+    global pending_writes
+    with pending_writes_lock:
+        if not pending_writes:
+            return
+        batch = pending_writes
+        pending_writes = {}
 
-def load_data():
-    global bot_ratings, bot_users
+    upserts = [(m, k, json.dumps(v)) for (m, k), v in batch.items() if v is not None]
+    deletes = [(m, k) for (m, k), v in batch.items() if v is None]
     try:
-        if os.path.exists("data.json"):
+        with state_db_lock, state_db:
+            state_db.executemany(
+                "INSERT INTO state (map, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (map, key) DO UPDATE SET value = excluded.value", upserts)
+            state_db.executemany("DELETE FROM state WHERE map = ? AND key = ?", deletes)
+    except Exception as e:
+        print(f"Error saving state: {e}")
+        count_error("state_flush")
+        # Put the batch back without overwriting anything newer
+        with pending_writes_lock:
+            for item, value in batch.items():
+                pending_writes.setdefault(item, value)
+
+def state_writer():
+    while not shutting_down.wait(STATE_FLUSH_INTERVAL_SEC):
+        flush_state()
+
+def import_legacy_data():
+    # One-time import of the old data.json (ratings + users)
+    try:
+        if os.path.exists("data.json") and os.path.getsize("data.json") > 0:
             with open("data.json", "r") as f:
                 data = json.load(f)
-                bot_ratings = {int(k): v for k, v in data.get("ratings", {}).items()}
-                bot_users = set(data.get("users", []))
+            for user_id, stars in data.get("ratings", {}).items():
+                bot_ratings[int(user_id)] = stars
+                state_set('ratings', int(user_id), stars)
+            for user_id in data.get("users", []):
+                bot_users.add(user_id)
+                state_set('users', user_id)
     except Exception as e:
         print(f"Error loading data: {e}")
 
-def save_data():
-    try:
-        with open("data.json", "w") as f:
-            json.dump({
-                "ratings": bot_ratings,
-                "users": list(bot_users)
-            }, f)
-    except Exception as e:
-        print(f"Error saving data: {e}")
+def load_state():
+    global state_db
+    state_db = open_state_db()
+    rows = state_db.execute("SELECT map, key, value FROM state ORDER BY rowid").fetchall()
+    for map_name, key, value in rows:
+        key = json.loads(key)
+        value = json.loads(value)
+        if map_name == 'ratings':
+            bot_ratings[key] = value
+        elif map_name == 'users':
+            bot_users.add(key)
+        elif map_name == 'auto_update_chats':
+            auto_update_chats.add(key)
+        elif map_name == 'chat_languages':
+            chat_languages[key] = value
+        elif map_name == 'seen_index':
+            seen_index[key] = True
+        elif map_name == 'random_cursors':
+            random_cursors[key] = value
+        elif map_name == 'random_pools':
+            # Old materialized index lists, replaced by random_cursors
+            state_delete('random_pools', key)
+        elif map_name == 'ai_cache':
+            ai_cache[tuple(key)] = value
+        elif map_name == 'image_file_ids':
+            image_file_ids[key] = value
+        elif map_name == 'translations':
+            translations[tuple(key)] = value
+        elif map_name == 'search_sessions':
+            # Served straight from the table; only expired ones need handling here
+            if time.time() - value.get('at', 0) > SEARCH_SESSION_TTL_SEC:
+                state_delete('search_sessions', key)
+    if not rows:
+        import_legacy_data()
+    refresh_archive_stats()
+
+def read_shared_map(map_name):
+    # Current contents of one map as every process sees it: the table plus this
+    # process's unflushed writes. Other workers' changes land in the table within
+    # STATE_FLUSH_INTERVAL_SEC, so this is how a process catches up with them
+    with state_db_lock:
+        rows = state_db.execute("SELECT key, value FROM state WHERE map = ? ORDER BY rowid", (map_name,)).fetchall()
+    values = {json.loads(key): json.loads(value) for key, value in rows}
+    with pending_writes_lock:
+        pending = [(key, value) for (name, key), value in pending_writes.items() if name == map_name]
+    for key, value in pending:
+        if value is None:
+            values.pop(json.loads(key), None)
+        else:
+            values[json.loads(key)] = value
+    return values
+
+def state_get(map_name, key, default=None):
+    # One value from the state table, or this process's unflushed write of it
+    item = (map_name, json.dumps(key))
+    with pending_writes_lock:
+        if item in pending_writes:
+            value = pending_writes[item]
+            return default if value is None else value
+    with state_db_lock:
+        row = state_db.execute("SELECT value FROM state WHERE map = ? AND key = ?", item).fetchone()
+    return json.loads(row[0]) if row else default
+
+def replace_contents(target, values):
+    # In place, so threads holding a reference see the new view
+    # Iterate over a snapshot: handler threads add and remove entries meanwhile
+    stale = [key for key in list(target) if key not in values]
+    for key in stale:
+        if isinstance(target, set):
+            target.discard(key)
+        else:
+            del target[key]
+    target.update(values)
+
+def reload_seen_index():
+    # A new leader diffs against what the previous leader already pushed, not
+    # against the copy it loaded at import
+    shared = read_shared_map('seen_index')
+    with seen_index_lock:
+        seen_index.clear()
+        for key in shared:
+            seen_index[key] = True
 
-load_data()
+def reload_shared_state():
+    replace_contents(auto_update_chats, set(read_shared_map('auto_update_chats')))
+    replace_contents(chat_languages, read_shared_map('chat_languages'))
+
+load_state()
+atexit.register(flush_state)
 
 # Localization
 STRINGS = {
@@ -74,16 +495,24 @@ STRINGS = {
                 "5) <code>/about</code>" + NL + "   About this bot." + NL + NL +
                 "6) <code>/ping</code>" + NL + "   Check bot latency." + NL + NL +
                 "7) <code>/rate</code>" + NL + "   Rate the bot!" + NL + NL +
-                "8) <code>/menu</code>" + NL + "   Opens menu.",
+                "8) <code>/menu</code>" + NL + "   Opens menu." + NL + NL +
+                "9) <code>/search words</code>" + NL + "   Search all news seen so far.",
         'no_news': "⚠️ No news available right now.",
         'ai_thinking': "🤖 Thinking...",
         'ai_error': "❌ Error communicating with AI.",
         'ai_prompt': "Please provide a question or request (e.g. 'draw a sunset').",
+        'ai_queued': "🤖 Thinking... (#{pos} in queue)",
+        'ai_busy': "⏳ AI is busy right now, please try again in a minute.",
+        'ai_slow_down': "⏳ You're sending AI requests too fast. Please wait a moment.",
+        'search_usage': "🔎 To search all news seen so far, type <code>/search your words</code>. Try: <code>/search one piece movie</code>",
+        'search_none': "🔎 No news found for that search.",
+        'search_heading': "SEARCH: {query}",
         'lang_set': "✅ Language set to English.",
         'lang_choose': "🌐 Choose your language:",
         'auto_on': "🔔 AutoUpdate is ON.",
         'auto_off': "🔕 AutoUpdate is OFF.",
         'choose_opt': "✅ Choose an option:",
+        'new_update': "🆕 <b>NEW RSS UPDATE!</b>",
         'ai_usage': "To use AI, type <code>/ai your question</code>. Try: 'draw a futuristic city' or 'make a 4s video of ocean waves'.",
         'about_text': "🤖 <b>Anime News Bot v2.0</b>" + NL + "Powered by Replit AI and Anime News Network RSS." + NL + "Owner: @yorichiiprime" + NL + "Now supports AI Image and Video generation!",
         'ping_text': "🏓 <b>Pong!</b>" + NL + "Latency: {ms}ms",
@@ -105,16 +534,24 @@ STRINGS = {
                 "5) <code>/about</code>" + NL + "   Bot ke baare mein jaanein." + NL + NL +
                 "6) <code>/ping</code>" + NL + "   Bot check karein." + NL + NL +
                 "7) <code>/rate</code>" + NL + "   Bot ko rate karein!" + NL + NL +
-                "8) <code>/menu</code>" + NL + "   Menu kholiye.",
+                "8) <code>/menu</code>" + NL + "   Menu kholiye." + NL + NL +
+                "9) <code>/search words</code>" + NL + "   Purani news mein search karein.",
         'no_news': "⚠️ Abhi koi news available nahi hai.",
         'ai_thinking': "🤖 Soch raha hoon...",
         'ai_error': "❌ Kuch error ho gaya hai.",
         'ai_prompt': "Kripya ek sawal ya request pucho (jaise 'ek tasveer banao').",
+        'ai_queued': "🤖 Soch raha hoon... (queue mein #{pos})",
+        'ai_busy': "⏳ AI abhi busy hai, thodi der baad try karein.",
+        'ai_slow_down': "⏳ Aap bahut jaldi requests bhej rahe hain. Thoda ruk jaiye.",
+        'search_usage': "🔎 Purani news search karne ke liye type karein: <code>/search aapke words</code>. Try: <code>/search one piece movie</code>",
+        'search_none': "🔎 Is search ke liye koi news nahi mili.",
+        'search_heading': "SEARCH: {query}",
         'lang_set': "✅ Bhasha Hinglish set ho gayi hai.",
         'lang_choose': "🌐 Apni bhasha chunein:",
         'auto_on': "🔔 AutoUpdate ON ho gaya hai.",
         'auto_off': "🔕 AutoUpdate OFF ho gaya hai.",
         'choose_opt': "✅ Ek option choose karein:",
+        'new_update': "🆕 <b>NAYI RSS UPDATE!</b>",
         'ai_usage': "AI use karne ke liye, type karein: <code>/ai aapka sawal</code>. Try: 'draw an anime character' ya 'make a short video of a cat'.",
         'about_text': "🤖 <b>Anime News Bot v2.0</b>" + NL + "Replit AI aur Anime News Network se powered." + NL + "Owner: @yorichiiprime" + NL + "Ab AI Image aur Video bhi bana sakta hai!",
         'ping_text': "🏓 <b>Pong!</b>" + NL + "Raftaar: {ms}ms",
@@ -133,7 +570,8 @@ STRINGS = {
                 "2) <code>/random</code>" + NL + "   5 случайных новостей." + NL + NL +
                 "3) <code>/ai question</code>" + NL + "   Спросите ИИ-помощника!" + NL + NL +
                 "4) <code>/language</code>" + NL + "   Сменить язык." + NL + NL +
-                "5) <code>/menu</code>" + NL + "   Открыть меню.",
+                "5) <code>/menu</code>" + NL + "   Открыть меню." + NL + NL +
+                "6) <code>/search слова</code>" + NL + "   Поиск по архиву новостей.",
         'no_news': "⚠️ Новости сейчас недоступны.",
         'ai_thinking': "🤖 Думаю...",
         'ai_error': "❌ Ошибка связи с ИИ.",
@@ -143,6 +581,7 @@ STRINGS = {
         'auto_on': "🔔 Автообновление ВКЛ.",
         'auto_off': "🔕 Автообновление ВЫКЛ.",
         'choose_opt': "✅ Выберите вариант:",
+        'new_update': "🆕 <b>НОВОЕ ОБНОВЛЕНИЕ RSS!</b>",
         'ai_usage': "Чтобы использовать ИИ, введите: <code>/ai ваш вопрос</code>"
     },
     'pt': {
@@ -152,7 +591,8 @@ STRINGS = {
                 "2) <code>/random</code>" + NL + "   5 notícias aleatórias." + NL + NL +
                 "3) <code>/ai question</code>" + NL + "   Pergunte ao assistente de IA!" + NL + NL +
                 "4) <code>/language</code>" + NL + "   Mudar idioma." + NL + NL +
-                "5) <code>/menu</code>" + NL + "   Abrir menu.",
+                "5) <code>/menu</code>" + NL + "   Abrir menu." + NL + NL +
+                "6) <code>/search palavras</code>" + NL + "   Buscar no arquivo de notícias.",
         'no_news': "⚠️ Nenhuma notícia disponível no momento.",
         'ai_thinking': "🤖 Pensando...",
         'ai_error': "❌ Erro ao comunicar com a IA.",
@@ -162,19 +602,39 @@ STRINGS = {
         'auto_on': "🔔 AutoUpdate está LIGADO.",
         'auto_off': "🔕 AutoUpdate está DESLIGADO.",
         'choose_opt': "✅ Escolha uma opção:",
+        'new_update': "🆕 <b>NOVA ATUALIZAÇÃO RSS!</b>",
         'ai_usage': "Para usar IA, digite: <code>/ai sua pergunta</code>"
     }
 }
 
+# Other workers may change a chat's language, so the local copy is re-read from
+# the state store once it is older than CHAT_LANGUAGE_TTL_SEC
+CHAT_LANGUAGE_TTL_SEC = 10
+CHAT_LANGUAGE_CHECKS_MAX = 50000
+chat_language_checked = OrderedDict() # chat_id -> when its language was last read, least recent first
+chat_language_checked_lock = threading.Lock()
+
 def get_lang(chat_id):
+    now = time.time()
+    with chat_language_checked_lock:
+        checked = chat_language_checked.pop(chat_id, None)
+        fresh = checked is not None and now - checked < CHAT_LANGUAGE_TTL_SEC
+        chat_language_checked[chat_id] = checked if fresh else now
+        while len(chat_language_checked) > CHAT_LANGUAGE_CHECKS_MAX:
+            chat_language_checked.popitem(last=False)
+    if not fresh:
+        lang = state_get('chat_languages', chat_id)
+        if lang in STRINGS:
+            chat_languages[chat_id] = lang
+        else:
+            chat_languages.pop(chat_id, None)
     return chat_languages.get(chat_id, 'en')
 
 def get_str(chat_id, key):
     lang = get_lang(chat_id)
     return STRINGS[lang].get(key, STRINGS['en'][key])
 
-@bot.message_handler(commands=["language"])
-def language_cmd(message):
+def language_markup():
     markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
         types.InlineKeyboardButton("English 🇺🇸", callback_data="lang_en"),
@@ -182,7 +642,12 @@ def language_cmd(message):
         types.InlineKeyboardButton("Russian 🇷🇺", callback_data="lang_ru"),
         types.InlineKeyboardButton("Portuguese 🇵🇹", callback_data="lang_pt")
     )
-    bot.send_message(message.chat.id, get_str(message.chat.id, 'lang_choose'), reply_markup=markup)
+    return markup
+
+@bot.message_handler(commands=["language"])
+@instrumented("language")
+def language_cmd(message):
+    bot.send_message(message.chat.id, get_str(message.chat.id, 'lang_choose'), reply_markup=language_markup())
 
 def menu_markup(chat_id=None):
     markup = types.InlineKeyboardMarkup(row_width=2)
@@ -196,13 +661,16 @@ def menu_markup(chat_id=None):
         types.InlineKeyboardButton("⭐ Rate Bot", callback_data="menu_rate"),
         types.InlineKeyboardButton("ℹ️ About", callback_data="menu_about"),
         types.InlineKeyboardButton("🏓 Ping", callback_data="menu_ping"),
-        types.InlineKeyboardButton("❓ Help", callback_data="menu_help")
+        types.InlineKeyboardButton("❓ Help", callback_data="menu_help"),
+        types.InlineKeyboardButton("🔎 Search", callback_data="menu_search")
     )
     return markup
 
-def back_to_menu_markup():
+def back_to_menu_markup(in_place=True):
+    # Menu screens swap back to the menu in place; content the user asked for
+    # (news lists, search results, status...) stays and a new menu is sent
     markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_home"))
+    markup.add(types.InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_home" if in_place else "menu_new"))
     return markup
 
 def entry_title_link(entry):
@@ -210,60 +678,485 @@ def entry_title_link(entry):
     link = getattr(entry, "link", "#")
     return str(title), str(link)
 
-def fetch_entries():
+# Feed cache: one shared copy of each feed, revalidated with ETag/Last-Modified.
+# Callers inside the TTL get the cached entries; once it expires the first caller
+# refetches under the per-feed lock while the others wait and reuse its result.
+FEED_CACHE_TTL_SEC = 60
+FEED_ERROR_RETRY_SEC = 15
+feed_cache = {} # url -> {'entries', 'etag', 'modified', 'fetched_at'}
+feed_locks = {}
+feed_locks_guard = threading.Lock()
+
+def get_feed_lock(url):
+    with feed_locks_guard:
+        if url not in feed_locks:
+            feed_locks[url] = threading.Lock()
+        return feed_locks[url]
+
+def feed_is_fresh(cached, now):
+    return cached is not None and now - cached['fetched_at'] < FEED_CACHE_TTL_SEC
+
+def feed_request_headers(cached):
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    if cached and cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached['modified']:
+        headers['If-Modified-Since'] = cached['modified']
+    return headers
+
+class FeedEntry:
+    # Only the fields the bot reads, named like feedparser's so either kind of entry works everywhere
+    __slots__ = ('id', 'title', 'link', 'published_parsed', 'summary')
+
+RSS_FIELDS = {'guid': 'id', 'title': 'title', 'link': 'link', 'description': 'summary'}
+RSS_PARSE_CHUNK = 64 * 1024
+
+def parse_rss_date(value):
     try:
-        response = requests.get(
-            RSS_URL,
-            headers={'User-Agent': 'Mozilla/5.0'},
-            timeout=15
-        )
-        if response.status_code == 200:
-            feed = feedparser.parse(response.content)
-            return getattr(feed, "entries", [])
-    except Exception:
-        pass
+        return email.utils.parsedate_to_datetime(value).utctimetuple()
+    except (TypeError, ValueError):
+        return None
+
+def parse_rss(content, limit=FEED_MAX_ITEMS):
+    # Single pass over plain RSS 2.0 that stops after `limit` items. Returns None
+    # for anything else (Atom, RDF, broken XML) so the caller can use feedparser
+    parser = ET.XMLPullParser(events=("start", "end"))
+    entries = []
+    root = None
+    channel = None
+    try:
+        for start in range(0, len(content), RSS_PARSE_CHUNK):
+            parser.feed(content[start:start + RSS_PARSE_CHUNK])
+            for event, elem in parser.read_events():
+                if root is None:
+                    if elem.tag != "rss":
+                        return None
+                    root = elem
+                elif event == "start" and elem.tag == "channel" and channel is None:
+                    channel = elem
+                elif event == "end" and elem.tag == "item":
+                    entry = FeedEntry()
+                    for child in elem:
+                        text = (child.text or "").strip()
+                        if child.tag in RSS_FIELDS and text:
+                            setattr(entry, RSS_FIELDS[child.tag], text)
+                        elif child.tag == "pubDate":
+                            published = parse_rss_date(text)
+                            if published:
+                                entry.published_parsed = published
+                    entries.append(entry)
+                    # Drop the parsed item so memory stays flat on big feeds
+                    if channel is not None and len(channel) and channel[-1] is elem:
+                        channel.remove(elem)
+                    if len(entries) >= limit:
+                        return entries
+        parser.close()
+    except ET.ParseError:
+        return None
+    return entries if channel is not None else None
+
+def parse_feed(content):
+    entries = parse_rss(content)
+    if entries is not None:
+        inc_metric("animebot_rss_parser_total", parser="stream")
+        return entries
+    inc_metric("animebot_rss_parser_total", parser="feedparser")
+    return feedparser.parse(content).entries[:FEED_MAX_ITEMS]
+
+# Archive: every fetched entry is kept in SQLite with an inverted index
+# (term -> doc, term frequency) so /search can rank old news with BM25 offline
+SEARCH_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "to", "was", "will", "with"
+}
+SEARCH_TITLE_WEIGHT = 2
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+def search_terms(text):
+    # Case and accent folding, stopwords and a light plural strip, same for documents and queries
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    terms = []
+    for word in re.findall(r"\w+", text):
+        if word in SEARCH_STOPWORDS or (len(word) < 2 and not word.isdigit()):
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+def strip_html(text):
+    return html.unescape(re.sub(r"<[^>]+>", " ", text))
+
+def archive_entries(entries):
+    by_guid = {entry_guid(entry): entry for entry in entries}
+    if not by_guid:
+        return
+    with state_db_lock:
+        guids = list(by_guid)
+        known = set()
+        for start in range(0, len(guids), 500):
+            chunk = guids[start:start + 500]
+            known.update(row[0] for row in state_db.execute(
+                "SELECT guid FROM archive WHERE guid IN (" + ",".join("?" * len(chunk)) + ")", chunk))
+        new = [guid for guid in guids if guid not in known]
+        if not new:
+            refresh_archive_stats()
+            return
+
+        with state_db:
+            for guid in new:
+                entry = by_guid[guid]
+                title, link = entry_title_link(entry)
+                counts = Counter(search_terms(title) * SEARCH_TITLE_WEIGHT + search_terms(strip_html(str(getattr(entry, "summary", "") or ""))))
+                published = getattr(entry, "published_parsed", None)
+                doc = state_db.execute(
+                    "INSERT INTO archive (guid, title, link, published, length) VALUES (?, ?, ?, ?, ?)",
+                    (guid, title, link, calendar.timegm(published) if published else int(time.time()), sum(counts.values()))).lastrowid
+                state_db.executemany("INSERT INTO postings (term, doc, tf) VALUES (?, ?, ?)",
+                                     [(term, doc, tf) for term, tf in counts.items()])
+        refresh_archive_stats()
+    inc_metric("animebot_archive_indexed_total", len(new))
+
+def search_archive(query, limit):
+    # BM25 over the postings of each distinct query term, best first (newer wins ties)
+    terms = list(dict.fromkeys(search_terms(query)))
+    if not terms:
+        return []
+    scores = {}
+    with state_db_lock:
+        if time.time() - archive_stats_at > ARCHIVE_STATS_TTL_SEC:
+            refresh_archive_stats()
+        if not archive_docs:
+            return []
+        avg_length = archive_total_length / archive_docs or 1
+        for term in terms:
+            postings = state_db.execute(
+                "SELECT p.doc, p.tf, a.length FROM postings p JOIN archive a ON a.id = p.doc WHERE p.term = ?", (term,)).fetchall()
+            if not postings:
+                continue
+            idf = math.log(1 + (archive_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf, length in postings:
+                norm = SEARCH_BM25_K1 * (1 - SEARCH_BM25_B + SEARCH_BM25_B * length / avg_length)
+                scores[doc] = scores.get(doc, 0) + idf * tf * (SEARCH_BM25_K1 + 1) / (tf + norm)
+    return [doc for doc, _ in heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))]
+
+def archive_rows(docs):
+    if not docs:
+        return []
+    with state_db_lock:
+        rows = state_db.execute("SELECT id, guid, title, link, published FROM archive WHERE id IN (" + ",".join("?" * len(docs)) + ")", docs).fetchall()
+    by_doc = {row[0]: row[1:] for row in rows}
+    return [by_doc[doc] for doc in docs if doc in by_doc]
+
+def store_feed_response(url, cached, status_code, content, headers):
+    # Returns the entries to serve, or None when the response is unusable
+    if status_code == 304 and cached:
+        inc_metric("animebot_feed_cache_total", result="revalidated")
+        cached['fetched_at'] = time.time()
+        return cached['entries']
+    if status_code == 200:
+        with timed("animebot_rss_parse_seconds"):
+            entries = parse_feed(content)
+        try:
+            with timed("animebot_archive_index_seconds"):
+                archive_entries(entries)
+        except Exception as e:
+            print(f"Archive error: {e}")
+            count_error("archive")
+        if entries or not cached or not cached['entries']:
+            inc_metric("animebot_feed_cache_total", result="miss")
+            feed_cache[url] = {
+                'entries': entries,
+                'etag': headers.get('ETag'),
+                'modified': headers.get('Last-Modified'),
+                'fetched_at': time.time()
+            }
+            return entries
+        return None
+    print(f"Feed fetch failed for {url}: HTTP {status_code}")
+    count_error("feed_http")
+    return None
+
+def serve_stale_feed(url, cached):
+    # Serve stale entries on error, and hold off for a short while before retrying.
+    # With nothing cached yet, an empty entry records the failure so callers
+    # waiting on the lock return straight away instead of refetching in turn
+    retry_at = time.time() - FEED_CACHE_TTL_SEC + FEED_ERROR_RETRY_SEC
+    if cached:
+        inc_metric("animebot_feed_cache_total", result="stale")
+        cached['fetched_at'] = retry_at
+        return cached['entries']
+    inc_metric("animebot_feed_cache_total", result="error")
+    feed_cache[url] = {'entries': [], 'etag': None, 'modified': None, 'fetched_at': retry_at}
     return []
 
+def fetch_feed(url):
+    cached = feed_cache.get(url)
+    if feed_is_fresh(cached, time.time()):
+        inc_metric("animebot_feed_cache_total", result="hit")
+        return cached['entries']
+
+    with get_feed_lock(url):
+        cached = feed_cache.get(url)
+        if feed_is_fresh(cached, time.time()):
+            return cached['entries']
+
+        try:
+            with timed("animebot_rss_fetch_seconds", feed=url):
+                response = requests.get(url, headers=feed_request_headers(cached), timeout=15)
+            entries = store_feed_response(url, cached, response.status_code, response.content, response.headers)
+            if entries is not None:
+                return entries
+        except Exception as e:
+            print(f"Feed fetch error for {url}: {e}")
+            count_error("feed_fetch")
+        return serve_stale_feed(url, cached)
+
+feed_executor = ThreadPoolExecutor(max_workers=4)
+
+def normalize_link(link):
+    parts = urllib.parse.urlsplit(link.strip())
+    scheme = "https" if parts.scheme.lower() == "http" else parts.scheme.lower()
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query) if not k.startswith("utm_")]
+    return urllib.parse.urlunsplit((
+        scheme,
+        parts.netloc.lower(),
+        parts.path.rstrip("/"),
+        urllib.parse.urlencode(query),
+        ""
+    ))
+
+def entry_guid(entry):
+    guid = getattr(entry, "id", None) or getattr(entry, "guid", None)
+    if guid:
+        return str(guid)
+    _, link = entry_title_link(entry)
+    return normalize_link(link)
+
+def entry_content_hash(entry):
+    title, _ = entry_title_link(entry)
+    normalized = " ".join(title.casefold().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def entry_published(entry):
+    return tuple(getattr(entry, "published_parsed", None) or ())
+
+def merge_feeds(feeds):
+    # Merge newest first and drop cross-feed duplicates
+    merged = []
+    hashes = set()
+    for entries in feeds:
+        for entry in entries:
+            content_hash = entry_content_hash(entry)
+            if content_hash not in hashes:
+                hashes.add(content_hash)
+                merged.append(entry)
+    merged.sort(key=entry_published, reverse=True)
+    return merged
+
+def fetch_entries():
+    if len(RSS_URLS) == 1:
+        return fetch_feed(RSS_URLS[0])
+    return merge_feeds(feed_executor.map(fetch_feed, RSS_URLS))
+
+def poll_new_entries():
+    # Returns the entries that appeared since the previous poll, oldest first.
+    # The first poll only seeds the index so a restart doesn't replay the feed.
+    entries = fetch_entries()
+    if not entries:
+        return []
+
+    with seen_index_lock:
+        seeding = not seen_index
+        new_entries = []
+        for entry in entries:
+            if not any(key in seen_index for key in (entry_guid(entry), entry_content_hash(entry))):
+                new_entries.append(entry)
+        # The feed is newest first: deliver the oldest MAX_NEW_PER_POLL now and
+        # leave the rest unmarked so the next poll picks them up
+        deferred = [] if seeding else new_entries[:-MAX_NEW_PER_POLL]
+        deferred_ids = {id(entry) for entry in deferred}
+        for entry in entries:
+            if id(entry) in deferred_ids:
+                continue
+            for key in (entry_guid(entry), entry_content_hash(entry)):
+                if key not in seen_index:
+                    state_set('seen_index', key)
+                seen_index[key] = True
+                seen_index.move_to_end(key)
+        while len(seen_index) > SEEN_INDEX_MAX:
+            key, _ = seen_index.popitem(last=False)
+            state_delete('seen_index', key)
+
+    if seeding:
+        return []
+    if deferred:
+        print(f"Deferred {len(deferred)} new entries to the next poll")
+        inc_metric("animebot_autoupdate_deferred_total", len(deferred))
+    return list(reversed(new_entries[len(deferred):]))
+
+translations_lock = threading.Lock()
+translation_call_lock = threading.Lock()
+translation_executor = ThreadPoolExecutor(max_workers=1)
+translation_queued = set() # (entry guid, lang) already waiting on the background executor
+translation_jobs = 0
+translation_queue_lock = threading.Lock()
+translation_retry_at = 0
+
+def localized_title(entry, lang):
+    title, _ = entry_title_link(entry)
+    if lang == 'en':
+        return title
+    return translations.get((entry_guid(entry), lang), title)
+
+def missing_translations(entries, langs):
+    langs = sorted(lang for lang in langs if lang != 'en')
+    with translations_lock:
+        pending = [entry for entry in entries if any((entry_guid(entry), lang) not in translations for lang in langs)]
+    return pending, langs
+
+def request_translations(titles, langs):
+    numbered = NL.join(f"{i}. {title}" for i, title in enumerate(titles, 1))
+    languages = ", ".join(f"{lang} = {LANG_NAMES[lang]}" for lang in langs)
+    with timed("animebot_translation_seconds"):
+        response = get_openai_client().with_options(timeout=TRANSLATION_TIMEOUT_SEC).chat.completions.create(
+            model=TRANSLATION_MODEL,
+            temperature=0,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": "You translate anime news headlines. Keep names of anime, people and studios unchanged. "
+                                              "Reply with only a JSON object mapping each language code to a list with one translation per headline, in the same order."},
+                {"role": "user", "content": f"Languages: {languages}{NL}Headlines:{NL}{numbered}"}
+            ]
+        )
+    return json.loads(response.choices[0].message.content or "{}")
+
+def translate_titles(entries, langs):
+    # Blocks for at most one batch call per TRANSLATION_BATCH_MAX titles; anything
+    # that fails or times out just stays in English. After a failure nothing is
+    # requested for TRANSLATION_FAILURE_BACKOFF_SEC
+    global translation_retry_at
+    pending, langs = missing_translations(entries, langs)
+    if not pending or not langs or time.time() < translation_retry_at:
+        return
+    with translation_call_lock:
+        pending, langs = missing_translations(pending, langs)
+        for start in range(0, len(pending), TRANSLATION_BATCH_MAX):
+            if time.time() < translation_retry_at:
+                return
+            batch = pending[start:start + TRANSLATION_BATCH_MAX]
+            try:
+                result = request_translations([entry_title_link(entry)[0] for entry in batch], langs)
+            except Exception as e:
+                print(f"Translation error: {e}")
+                count_error("translation")
+                translation_retry_at = time.time() + TRANSLATION_FAILURE_BACKOFF_SEC
+                return
+            with translations_lock:
+                for lang in langs:
+                    titles = result.get(lang)
+                    if not isinstance(titles, list) or len(titles) != len(batch):
+                        continue
+                    for entry, title in zip(batch, titles):
+                        key = (entry_guid(entry), lang)
+                        translations[key] = str(title).strip() or entry_title_link(entry)[0]
+                        state_set('translations', key, translations[key])
+                while len(translations) > TRANSLATIONS_MAX:
+                    key, _ = translations.popitem(last=False)
+                    state_delete('translations', key)
+
+def translate_in_background(entries, lang):
+    # The interactive path never waits: show English now, localized next time.
+    # Titles already queued are skipped and at most TRANSLATION_QUEUE_MAX jobs wait
+    global translation_jobs
+    if lang == 'en' or time.time() < translation_retry_at:
+        return
+    pending, _ = missing_translations(entries, [lang])
+    with translation_queue_lock:
+        pending = [entry for entry in pending if (entry_guid(entry), lang) not in translation_queued]
+        if not pending or translation_jobs >= TRANSLATION_QUEUE_MAX:
+            return
+        keys = {(entry_guid(entry), lang) for entry in pending}
+        translation_queued.update(keys)
+        translation_jobs += 1
+    translation_executor.submit(run_background_translation, pending, lang, keys)
+
+def run_background_translation(entries, lang, keys):
+    global translation_jobs
+    try:
+        translate_titles(entries, [lang])
+    finally:
+        with translation_queue_lock:
+            translation_queued.difference_update(keys)
+            translation_jobs -= 1
+
+def active_languages():
+    return set(chat_languages.values()) - {'en'}
+
+def format_entries(entries, heading, lang='en'):
+    msg = "<b>" + heading + "</b>" + NL + NL
+    for i, entry in enumerate(entries, 1):
+        _, link = entry_title_link(entry)
+        msg = msg + "✅ " + str(i) + ") " + html.escape(localized_title(entry, lang)) + NL + "🔗 " + html.escape(link) + NL + NL
+    return msg
+
 def send_entries(chat_id, entries, heading):
     if not entries:
         bot.send_message(chat_id, get_str(chat_id, 'no_news'), disable_web_page_preview=False,
-                         reply_markup=back_to_menu_markup())
+                         reply_markup=back_to_menu_markup(in_place=False))
         return
 
-    msg = "<b>" + heading + "</b>" + NL + NL
-    i = 1
-    for entry in entries:
-        title, link = entry_title_link(entry)
-        msg = msg + "✅ " + str(i) + ") " + title + NL + "🔗 " + link + NL + NL
-    bot.send_message(chat_id, msg, disable_web_page_preview=False, reply_markup=back_to_menu_markup(), parse_mode="HTML")
+    translate_in_background(entries, get_lang(chat_id))
+    bot.send_message(chat_id, format_entries(entries, heading, get_lang(chat_id)), disable_web_page_preview=False, reply_markup=back_to_menu_markup(in_place=False), parse_mode="HTML")
+
+def random_rank(seed, entry):
+    return hashlib.sha1(f"{seed}:{entry_guid(entry)}".encode()).hexdigest()
 
 def get_random_5(chat_id):
-    entries = fetch_entries()
+    return pick_random_5(chat_id, fetch_entries())
+
+def pick_random_5(chat_id, entries):
+    # Each chat walks the feed in the order of hash(seed, guid). The cursor only
+    # stores the seed and the last rank shown, so it stays tiny and keeps working
+    # when the feed changes: new entries slot into the order, removed ones vanish
     if not entries:
         return []
 
-    if chat_id not in random_pools or len(random_pools[chat_id]) < 5:
-        idxs = list(range(len(entries)))
-        random.shuffle(idxs)
-        random_pools[chat_id] = idxs
+    with random_cursors_lock:
+        cursor = random_cursors.pop(chat_id, None)
+        remaining = []
+        if cursor:
+            remaining = sorted((rank, i) for i, rank in enumerate(random_rank(cursor['seed'], e) for e in entries) if rank > cursor['after'])
+        if len(remaining) < 5:
+            cursor = {'seed': random.getrandbits(32), 'after': ""}
+            remaining = sorted((random_rank(cursor['seed'], e), i) for i, e in enumerate(entries))
 
-    pick_idxs = random_pools[chat_id][:5]
-    random_pools[chat_id] = random_pools[chat_id][5:]
+        picks = remaining[:5]
+        cursor['after'] = picks[-1][0]
+        random_cursors[chat_id] = cursor
+        state_set('random_cursors', chat_id, cursor)
+        while len(random_cursors) > RANDOM_CURSORS_MAX:
+            idle_chat, _ = random_cursors.popitem(last=False)
+            state_delete('random_cursors', idle_chat)
 
-    return [entries[i] for i in pick_idxs]
+    return [entries[i] for _, i in picks]
 
 @bot.message_handler(commands=["start"])
+@instrumented("start")
 def start_cmd(message):
-    bot_users.add(message.from_user.id)
-    save_data()
+    if message.from_user.id not in bot_users:
+        bot_users.add(message.from_user.id)
+        state_set('users', message.from_user.id)
     user = message.from_user
     name = ("@" + user.username) if user.username else user.first_name
     text = get_str(message.chat.id, 'welcome').format(name=name, NL=NL)
     bot.reply_to(message, text, reply_markup=menu_markup(message.chat.id), parse_mode="HTML")
 
 @bot.message_handler(commands=["rate"])
+@instrumented("rate")
 def rate_cmd(message):
-    if message.from_user.id in bot_ratings:
+    if message.from_user.id in bot_ratings or state_get('ratings', message.from_user.id) is not None:
         bot.reply_to(message, "Thank you for rating! ❤️")
         return
         
@@ -273,11 +1166,14 @@ def rate_cmd(message):
     bot.send_message(message.chat.id, get_str(message.chat.id, 'rate_msg'), reply_markup=markup, parse_mode="HTML")
 
 @bot.message_handler(commands=["status"])
+@instrumented("status")
 def status_cmd(message):
     if message.from_user.id != OWNER_ID:
         bot.reply_to(message, "Do you think that you can be the owner 🤔")
         return
     
+    replace_contents(bot_ratings, read_shared_map('ratings'))
+    replace_contents(bot_users, set(read_shared_map('users')))
     total_users = len(bot_users)
     total_ratings = len(bot_ratings)
     avg_rating = round(sum(bot_ratings.values()) / total_ratings, 2) if total_ratings > 0 else 0
@@ -295,28 +1191,34 @@ def status_cmd(message):
         f"⭐ <b>Average Rate:</b> <code>{avg_rating}/5</code>" + NL +
         f"📊 <b>Rating Score:</b> {rating_bar}" + NL +
         f"📝 <b>Total Reviews:</b> <code>{total_ratings}</code>" + NL +
+        f"🧠 <b>AI Cache:</b> <code>{ai_cache_stats['hits'] + ai_cache_stats['fuzzy_hits']} hits / {ai_cache_stats['misses']} misses ({len(ai_cache)} saved)</code>" + NL +
+        f"🗄 <b>News Archive:</b> <code>{archive_docs} articles</code>" + NL +
         "━━━━━━━━━━━━━━━━━━━━" + NL +
         "<i>Status is live and updated.</i>"
     )
-    bot.send_message(message.chat.id, text, parse_mode="HTML", reply_markup=back_to_menu_markup())
+    bot.send_message(message.chat.id, text, parse_mode="HTML", reply_markup=back_to_menu_markup(in_place=False))
 
 @bot.message_handler(commands=["help"])
+@instrumented("help")
 def help_cmd(message):
     bot.send_message(message.chat.id, get_str(message.chat.id, 'help'), reply_markup=menu_markup(message.chat.id), parse_mode="HTML")
 
 @bot.message_handler(commands=["latest"])
+@instrumented("latest")
 def latest_cmd(message):
     entries = fetch_entries()
     if not entries:
-        bot.reply_to(message, get_str(message.chat.id, 'no_news'), reply_markup=back_to_menu_markup())
+        bot.reply_to(message, get_str(message.chat.id, 'no_news'), reply_markup=back_to_menu_markup(in_place=False))
         return
     send_entries(message.chat.id, entries[:10], "LATEST ANIME NEWS")
 
 @bot.message_handler(commands=["about"])
+@instrumented("about")
 def about_cmd(message):
-    bot.send_message(message.chat.id, get_str(message.chat.id, 'about_text'), parse_mode="HTML", reply_markup=back_to_menu_markup())
+    bot.send_message(message.chat.id, get_str(message.chat.id, 'about_text'), parse_mode="HTML", reply_markup=back_to_menu_markup(in_place=False))
 
 @bot.message_handler(commands=["ping"])
+@instrumented("ping")
 def ping_cmd(message):
     start_time = time.time()
     msg = bot.reply_to(message, "Pinging...")
@@ -324,7 +1226,460 @@ def ping_cmd(message):
     latency = round((end_time - start_time) * 1000)
     bot.edit_message_text(get_str(message.chat.id, 'ping_text').format(ms=latency), message.chat.id, msg.message_id, parse_mode="HTML")
 
+SEARCH_PAGE_SIZE = 5
+SEARCH_MAX_RESULTS = 50
+SEARCH_SESSIONS_MAX = 10000
+# Each search gets an id that goes into its Prev/Next buttons, so an older results
+# message keeps paging through its own results. Sessions are also written to the
+# state store so any worker can serve the buttons
+search_sessions = OrderedDict() # search id -> {'chat_id', 'query', 'docs'}, least recent first
+search_sessions_lock = threading.Lock()
+
+def get_search_session(search_id):
+    with search_sessions_lock:
+        session = search_sessions.get(search_id)
+        if session:
+            search_sessions.move_to_end(search_id)
+            return session
+    return state_get('search_sessions', search_id)
+
+def search_page(chat_id, search_id, page):
+    # Returns (text, markup) for one page of a search, or None if it expired
+    session = get_search_session(search_id)
+    if not session or session['chat_id'] != chat_id:
+        return None
+
+    docs = session['docs']
+    pages = (len(docs) + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    first = page * SEARCH_PAGE_SIZE
+    lang = get_lang(chat_id)
+    heading = get_str(chat_id, 'search_heading').format(query=html.escape(session['query']))
+    msg = "<b>" + heading + "</b> (" + str(page + 1) + "/" + str(pages) + ")" + NL + NL
+    for i, (guid, title, link, published) in enumerate(archive_rows(docs[first:first + SEARCH_PAGE_SIZE]), first + 1):
+        title = translations.get((guid, lang), title) if lang != 'en' else title
+        date = time.strftime("%d %b %Y", time.gmtime(published))
+        msg = msg + "✅ " + str(i) + ") " + html.escape(title) + NL + "🗓 " + date + NL + "🔗 " + html.escape(link) + NL + NL
+
+    markup = types.InlineKeyboardMarkup()
+    nav = []
+    if page > 0:
+        nav.append(types.InlineKeyboardButton("◀️ Prev", callback_data=f"search_{page - 1}_{search_id}"))
+    if page < pages - 1:
+        nav.append(types.InlineKeyboardButton("Next ▶️", callback_data=f"search_{page + 1}_{search_id}"))
+    if nav:
+        markup.row(*nav)
+    markup.add(types.InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_new"))
+    return msg, markup
+
+@bot.message_handler(commands=["search"])
+@instrumented("search")
+def search_cmd(message):
+    chat_id = message.chat.id
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        bot.reply_to(message, get_str(chat_id, 'search_usage'), parse_mode="HTML", reply_markup=back_to_menu_markup(in_place=False))
+        return
+
+    query = parts[1].strip()
+    with timed("animebot_search_seconds"):
+        docs = search_archive(query, SEARCH_MAX_RESULTS)
+    if not docs:
+        bot.reply_to(message, get_str(chat_id, 'search_none'), reply_markup=back_to_menu_markup(in_place=False))
+        return
+
+    search_id = os.urandom(6).hex()
+    session = {'chat_id': chat_id, 'query': query, 'docs': docs, 'at': time.time()}
+    with search_sessions_lock:
+        search_sessions[search_id] = session
+        state_set('search_sessions', search_id, session)
+        while len(search_sessions) > SEARCH_SESSIONS_MAX:
+            expired, _ = search_sessions.popitem(last=False)
+            state_delete('search_sessions', expired)
+    text, markup = search_page(chat_id, search_id, 0)
+    bot.send_message(chat_id, text, reply_markup=markup, parse_mode="HTML", disable_web_page_preview=True)
+
+AI_MODEL = "llama-3.3-70b-versatile"
+IMAGE_TRIGGERS = ["draw", "image", "picture", "generate image", "tasveer", "photo", "create image"]
+LANG_NAMES = {'en': 'English', 'hi': 'Hinglish', 'ru': 'Russian', 'pt': 'Portuguese'}
+# Streaming replies: edit the "Thinking..." message as tokens arrive, at most once
+# per AI_EDIT_INTERVAL_SEC, and continue in a new message past Telegram's 4096 limit
+AI_STREAMING = os.environ.get("AI_STREAMING", "1") == "1"
+AI_EDIT_INTERVAL_SEC = 1.5
+AI_REPLY_CHUNK = 4000
+# AI scheduler: a bounded queue drained by AI_CONCURRENCY workers, per-user token
+# buckets, and identical in-flight prompts (same query + language) share one call
+AI_CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", "4"))
+AI_QUEUE_MAX = 100
+AI_USER_RATE_PER_MIN = 6
+AI_USER_BURST = 3
+AI_USER_BUCKETS_MAX = 10000
+# AI response cache: LRU with a TTL, bounded by entries and total characters and
+# persisted in the state store. AI_CACHE_FUZZY also matches near-duplicate queries
+AI_CACHE_TTL_SEC = 6 * 3600
+AI_CACHE_MAX_ENTRIES = 1000
+AI_CACHE_MAX_CHARS = 2_000_000
+AI_CACHE_PERSIST = os.environ.get("AI_CACHE_PERSIST", "1") == "1"
+AI_CACHE_FUZZY = os.environ.get("AI_CACHE_FUZZY", "0") == "1"
+AI_CACHE_FUZZY_MIN_SIMILARITY = 0.8
+# Generated images are resent by Telegram file_id. IMAGE_CACHE_POLICY is "lru" or
+# "lfu". Prompts whose send keeps failing (usually Pollinations being slower than
+# Telegram's URL fetch) are backfilled: rendered in the background and uploaded
+# to IMAGE_CACHE_CHAT_ID (e.g. a private channel) to obtain a file_id
+IMAGE_CACHE_MAX = int(os.environ.get("IMAGE_CACHE_MAX", "500"))
+IMAGE_CACHE_POLICY = os.environ.get("IMAGE_CACHE_POLICY", "lru")
+IMAGE_CACHE_CHAT_ID = int(os.environ.get("IMAGE_CACHE_CHAT_ID", "0"))
+IMAGE_BACKFILL_MIN_FAILURES = 2
+IMAGE_BACKFILL_QUEUE_MAX = 20
+IMAGE_FAILURE_COUNTS_MAX = 5000
+
+def is_image_request(query):
+    query_lower = query.lower()
+    return any(trigger in query_lower for trigger in IMAGE_TRIGGERS)
+
+def image_url_for(query):
+    prompt_encoded = urllib.parse.quote(query)
+    return f"https://image.pollinations.ai/prompt/{prompt_encoded}?width=1024&height=1024&nologo=true"
+
+def ai_messages(chat_id, query):
+    lang_name = LANG_NAMES.get(get_lang(chat_id), 'English')
+    return [
+        {"role": "system", "content": f"You are a professional AI Assistant for the Anime News bot. Respond in {lang_name}."},
+        {"role": "user", "content": query}
+    ]
+
+def split_reply(text, limit):
+    cut = text.rfind(NL, 0, limit)
+    if cut < limit // 2:
+        cut = text.rfind(" ", 0, limit)
+    if cut <= 0:
+        cut = limit
+    return text[:cut], text[cut:].lstrip()
+
+class StreamedReply:
+    # Turns an answer that grows token by token into "progress", "edit" and "send"
+    # actions; edits target message_id, which a "send" replaces with the new message
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self.text = ""
+        self.shown = ""
+        self.last_edit = 0.0
+
+    def roll_over(self):
+        actions = []
+        while len(self.text) > AI_REPLY_CHUNK:
+            head, self.text = split_reply(self.text, AI_REPLY_CHUNK)
+            actions.append(("edit", head))
+            actions.append(("send", "…"))
+            self.shown = ""
+        return actions
+
+    def feed(self, delta, progress=True):
+        self.text += delta
+        actions = self.roll_over()
+        now = time.monotonic()
+        if progress and self.text.strip() and self.text != self.shown and now - self.last_edit >= AI_EDIT_INTERVAL_SEC:
+            actions.append(("progress", self.text + " ▌"))
+            self.shown = self.text
+            self.last_edit = now
+        return actions
+
+    def finish(self):
+        actions = self.roll_over()
+        actions.append(("edit", self.text if self.text.strip() else "Error"))
+        return actions
+
+def stream_deltas(stream):
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def apply_reply_actions(chat_id, reply, actions):
+    for kind, text in actions:
+        if kind == "send":
+            reply.message_id = bot.send_message(chat_id, text).message_id
+        elif kind == "edit":
+            bot.edit_message_text(text, chat_id, reply.message_id)
+        else:
+            # A skipped progress edit is caught up by the next one
+            try:
+                bot.edit_message_text(text, chat_id, reply.message_id)
+            except ApiTelegramException as e:
+                print(f"AI edit skipped: {e}")
+
+ai_queue = queue.Queue(maxsize=AI_QUEUE_MAX)
+ai_flights = {} # (normalized query, lang) -> AiFlight
+ai_flights_lock = threading.Lock()
+ai_user_buckets = OrderedDict()
+ai_active = 0
+
+class AiFlight:
+    # One upstream completion shared by every chat that asked the same thing
+    def __init__(self, key, chat_id, query):
+        self.key = key
+        self.chat_id = chat_id
+        self.query = query
+        self.text = ""
+        self.failed = False
+        self.subscribers = [] # (chat_id, StreamedReply)
+
+    def join(self, chat_id, reply):
+        # Caller holds ai_flights_lock; a late joiner catches up on the text so far
+        self.subscribers.append((chat_id, reply))
+        return reply.feed(self.text) if self.text else []
+
+    def feed(self, delta, progress=True):
+        with ai_flights_lock:
+            self.text += delta
+            return [(chat_id, reply, reply.feed(delta, progress)) for chat_id, reply in self.subscribers]
+
+    def finish(self):
+        # Cache before leaving ai_flights so no request slips in between
+        if not self.failed and self.text.strip():
+            ai_cache_put(self.key, self.text)
+        with ai_flights_lock:
+            if ai_flights.get(self.key) is self:
+                del ai_flights[self.key]
+            if self.failed:
+                return [(chat_id, reply, [("edit", get_str(chat_id, 'ai_error'))]) for chat_id, reply in self.subscribers]
+            return [(chat_id, reply, reply.finish()) for chat_id, reply in self.subscribers]
+
+def normalize_query(query):
+    return " ".join(query.casefold().split()).strip(" ?!.")
+
+def ai_request_key(chat_id, query):
+    return (normalize_query(query), get_lang(chat_id))
+
+def query_shingles(text):
+    padded = " " + text + " "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def queries_similar(a, b, shingles_a, shingles_b):
+    # Jaccard similarity of character 3-grams; numbers must match exactly so
+    # "best anime of 2024" never answers "best anime of 2025"
+    if re.findall(r"\d+", a) != re.findall(r"\d+", b):
+        return False
+    overlap = len(shingles_a & shingles_b)
+    return overlap / (len(shingles_a) + len(shingles_b) - overlap) >= AI_CACHE_FUZZY_MIN_SIMILARITY
+
+ai_cache_lock = threading.Lock()
+ai_cache_shingles = {} # cache key -> query_shingles, built on demand
+ai_cache_chars = sum(len(entry['text']) for entry in ai_cache.values())
+ai_cache_stats = {'hits': 0, 'fuzzy_hits': 0, 'misses': 0}
+
+def ai_cache_drop(key):
+    global ai_cache_chars
+    entry = ai_cache.pop(key)
+    ai_cache_shingles.pop(key, None)
+    ai_cache_chars -= len(entry['text'])
+    if AI_CACHE_PERSIST:
+        state_delete('ai_cache', key)
+
+def ai_cache_get(key):
+    with ai_cache_lock:
+        entry = ai_cache.get(key)
+        if entry and time.time() - entry['at'] > AI_CACHE_TTL_SEC:
+            ai_cache_drop(key)
+            entry = None
+        if entry:
+            ai_cache.move_to_end(key)
+            ai_cache_stats['hits'] += 1
+            return entry['text']
+
+        if AI_CACHE_FUZZY:
+            shingles = query_shingles(key[0])
+            now = time.time()
+            for other_key, other in reversed(ai_cache.items()):
+                if other_key[1] != key[1] or now - other['at'] > AI_CACHE_TTL_SEC:
+                    continue
+                if other_key not in ai_cache_shingles:
+                    ai_cache_shingles[other_key] = query_shingles(other_key[0])
+                if queries_similar(key[0], other_key[0], shingles, ai_cache_shingles[other_key]):
+                    ai_cache.move_to_end(other_key)
+                    ai_cache_stats['fuzzy_hits'] += 1
+                    return other['text']
+
+        ai_cache_stats['misses'] += 1
+        return None
+
+def ai_cache_put(key, text):
+    global ai_cache_chars
+    with ai_cache_lock:
+        if key in ai_cache:
+            ai_cache_drop(key)
+        entry = {'text': text, 'at': time.time()}
+        ai_cache[key] = entry
+        ai_cache_chars += len(text)
+        if AI_CACHE_PERSIST:
+            state_set('ai_cache', key, entry)
+        while len(ai_cache) > AI_CACHE_MAX_ENTRIES or ai_cache_chars > AI_CACHE_MAX_CHARS:
+            ai_cache_drop(next(iter(ai_cache)))
+
+image_cache_lock = threading.Lock()
+image_failure_counts = OrderedDict() # normalized prompt -> failed sends, least recent first
+image_backfill_queue = queue.Queue(maxsize=IMAGE_BACKFILL_QUEUE_MAX)
+image_backfill_pending = set()
+
+def image_cache_get(key):
+    with image_cache_lock:
+        entry = image_file_ids.get(key)
+        if not entry:
+            inc_metric("animebot_image_cache_total", result="miss")
+            return None
+        inc_metric("animebot_image_cache_total", result="hit")
+        entry['hits'] += 1
+        image_file_ids.move_to_end(key)
+        state_set('image_file_ids', key, entry)
+        return entry['file_id']
+
+def image_cache_drop(key):
+    with image_cache_lock:
+        if image_file_ids.pop(key, None):
+            state_delete('image_file_ids', key)
+
+def image_cache_put(key, file_id):
+    with image_cache_lock:
+        entry = image_file_ids.pop(key, None)
+        if entry is None:
+            # A new prompt starts level with the least used one, so LFU doesn't
+            # evict it before it had a chance to be hit
+            entry = {'hits': min((e['hits'] for e in image_file_ids.values()), default=0)}
+        entry['file_id'] = file_id
+        image_file_ids[key] = entry
+        state_set('image_file_ids', key, entry)
+        image_failure_counts.pop(key, None)
+        while len(image_file_ids) > IMAGE_CACHE_MAX:
+            if IMAGE_CACHE_POLICY == "lfu":
+                # Ties go to the least recently used; never the prompt just stored
+                victim = min((k for k in image_file_ids if k != key), key=lambda k: image_file_ids[k]['hits'])
+            else:
+                victim = next(iter(image_file_ids))
+            del image_file_ids[victim]
+            state_delete('image_file_ids', victim)
+
+def note_image_failure(key, query):
+    # Queue a background render once sending a prompt has failed repeatedly
+    if not IMAGE_CACHE_CHAT_ID:
+        return
+    with image_cache_lock:
+        failures = image_failure_counts.pop(key, 0) + 1
+        image_failure_counts[key] = failures
+        while len(image_failure_counts) > IMAGE_FAILURE_COUNTS_MAX:
+            image_failure_counts.popitem(last=False)
+        if failures < IMAGE_BACKFILL_MIN_FAILURES or key in image_backfill_pending:
+            return
+        try:
+            image_backfill_queue.put_nowait((key, query))
+            image_backfill_pending.add(key)
+        except queue.Full:
+            pass
+
+def image_backfill_worker():
+    while True:
+        key, query = image_backfill_queue.get()
+        try:
+            if key not in image_file_ids:
+                # Pollinations can take longer than Telegram waits for a URL, so
+                # download it ourselves and upload the bytes to the cache chat
+                with timed("animebot_pollinations_seconds", path="backfill"):
+                    response = requests.get(image_url_for(query), timeout=120)
+                response.raise_for_status()
+                sent = bot.send_photo(IMAGE_CACHE_CHAT_ID, response.content, caption=query)
+                image_cache_put(key, sent.photo[-1].file_id)
+        except Exception as e:
+            print(f"Image backfill error: {e}")
+            count_error("image_backfill")
+        finally:
+            with image_cache_lock:
+                image_backfill_pending.discard(key)
+
+def split_long_reply(text):
+    chunks = []
+    while len(text) > AI_REPLY_CHUNK:
+        head, text = split_reply(text, AI_REPLY_CHUNK)
+        chunks.append(head)
+    chunks.append(text)
+    return chunks
+
+def ai_user_allowed(user_id):
+    with ai_flights_lock:
+        bucket = ai_user_buckets.pop(user_id, None) or TokenBucket(AI_USER_RATE_PER_MIN / 60, AI_USER_BURST)
+        ai_user_buckets[user_id] = bucket
+        while len(ai_user_buckets) > AI_USER_BUCKETS_MAX:
+            ai_user_buckets.popitem(last=False)
+    return bucket.try_acquire()
+
+def ai_queue_position(jobs):
+    # Estimated place in line, 0 when a worker is free to start right away
+    with ai_flights_lock:
+        return jobs.qsize() + 1 if ai_active >= AI_CONCURRENCY else 0
+
+def schedule_ai_flight(jobs, chat_id, query, reply):
+    # Returns (scheduled, actions); actions bring a late joiner up to date
+    key = ai_request_key(chat_id, query)
+    with ai_flights_lock:
+        flight = ai_flights.get(key)
+        if flight:
+            return True, flight.join(chat_id, reply)
+        flight = AiFlight(key, chat_id, query)
+        try:
+            jobs.put_nowait(flight)
+        except (queue.Full, asyncio.QueueFull):
+            return False, []
+        ai_flights[key] = flight
+        return True, flight.join(chat_id, reply)
+
+def set_ai_active(delta):
+    global ai_active
+    with ai_flights_lock:
+        ai_active += delta
+
+def apply_flight_actions(flight_actions):
+    # One chat failing to update must not stop the others
+    for chat_id, reply, actions in flight_actions:
+        try:
+            apply_reply_actions(chat_id, reply, actions)
+        except Exception as e:
+            print(f"AI reply error for {chat_id}: {e}")
+            count_error("ai_reply")
+
+def run_ai_flight(flight):
+    start = time.perf_counter()
+    try:
+        if AI_STREAMING:
+            stream = get_openai_client().chat.completions.create(
+                model=AI_MODEL,
+                messages=ai_messages(flight.chat_id, flight.query),
+                stream=True
+            )
+            for delta in stream_deltas(stream):
+                if not flight.text:
+                    observe_metric("animebot_groq_first_token_seconds", time.perf_counter() - start)
+                apply_flight_actions(flight.feed(delta))
+        else:
+            response = get_openai_client().chat.completions.create(
+                model=AI_MODEL,
+                messages=ai_messages(flight.chat_id, flight.query)
+            )
+            apply_flight_actions(flight.feed(str(response.choices[0].message.content or "Error"), progress=False))
+    except Exception as e:
+        print(f"AI Error: {e}")
+        count_error("ai")
+        flight.failed = True
+    observe_metric("animebot_groq_completion_seconds", time.perf_counter() - start)
+    apply_flight_actions(flight.finish())
+
+def ai_worker():
+    while True:
+        flight = ai_queue.get()
+        set_ai_active(1)
+        try:
+            run_ai_flight(flight)
+        finally:
+            set_ai_active(-1)
+
 @bot.message_handler(commands=["ai"])
+@instrumented("ai")
 def ai_cmd(message):
     parts = message.text.split(maxsplit=1)
     if len(parts) < 2:
@@ -332,57 +1687,107 @@ def ai_cmd(message):
         return
 
     query = parts[1].strip()
-    query_lower = query.lower()
 
-    # --- Image Generation (Pollinations AI - Free & Fast) ---
-    image_triggers = ["draw", "image", "picture", "generate image", "tasveer", "photo", "create image"]
-    if any(trigger in query_lower for trigger in image_triggers):
+    # --- Image Generation (Pollinations AI - Free & Fast, resent by file_id) ---
+    if is_image_request(query):
+        image_key = normalize_query(query)
+        file_id = image_cache_get(image_key)
+        if file_id:
+            try:
+                bot.send_photo(message.chat.id, file_id, caption=f"🎨 Generated for: {query}")
+                return
+            except ApiTelegramException as e:
+                print(f"Cached image rejected: {e}")
+                image_cache_drop(image_key)
+
         bot.reply_to(message, get_str(message.chat.id, 'gen_image'))
         try:
-            prompt_encoded = urllib.parse.quote(query)
-            image_url = f"https://image.pollinations.ai/prompt/{prompt_encoded}?width=1024&height=1024&nologo=true"
-            bot.send_photo(message.chat.id, image_url, caption=f"🎨 Generated for: {query}")
+            with timed("animebot_pollinations_seconds", path="send"):
+                sent = bot.send_photo(message.chat.id, image_url_for(query), caption=f"🎨 Generated for: {query}")
+            image_cache_put(image_key, sent.photo[-1].file_id)
             return
         except Exception as e:
             print(f"Image Gen Error: {e}")
+            count_error("image")
+            note_image_failure(image_key, query)
             bot.reply_to(message, get_str(message.chat.id, 'gen_error'))
             return
 
-    # --- Chat Response (Groq Llama 3) ---
-    processing_msg = bot.reply_to(message, get_str(message.chat.id, 'ai_thinking'))
-    try:
-        lang_name = {'en': 'English', 'hi': 'Hinglish', 'ru': 'Russian', 'pt': 'Portuguese'}.get(get_lang(message.chat.id), 'English')
-        response = openai_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": f"You are a professional AI Assistant for the Anime News bot. Respond in {lang_name}."},
-                {"role": "user", "content": query}
-            ]
-        )
-        ai_response = str(response.choices[0].message.content or "Error")
-        bot.edit_message_text(ai_response, message.chat.id, processing_msg.message_id)
-    except Exception as e:
-        print(f"AI Error: {e}")
-        bot.edit_message_text(get_str(message.chat.id, 'ai_error'), message.chat.id, processing_msg.message_id)
+    # --- Chat Response (Groq Llama 3, through the AI cache and scheduler) ---
+    chat_id = message.chat.id
+    cached = ai_cache_get(ai_request_key(chat_id, query))
+    if cached:
+        chunks = split_long_reply(cached)
+        bot.reply_to(message, chunks[0])
+        for chunk in chunks[1:]:
+            bot.send_message(chat_id, chunk)
+        return
+
+    if not ai_user_allowed(message.from_user.id):
+        bot.reply_to(message, get_str(chat_id, 'ai_slow_down'))
+        return
+    if ai_queue.full():
+        bot.reply_to(message, get_str(chat_id, 'ai_busy'))
+        return
+
+    position = ai_queue_position(ai_queue)
+    thinking = get_str(chat_id, 'ai_queued').format(pos=position) if position else get_str(chat_id, 'ai_thinking')
+    processing_msg = bot.reply_to(message, thinking)
+    reply = StreamedReply(processing_msg.message_id)
+    scheduled, actions = schedule_ai_flight(ai_queue, chat_id, query, reply)
+    if not scheduled:
+        bot.edit_message_text(get_str(chat_id, 'ai_busy'), chat_id, reply.message_id)
+        return
+    apply_reply_actions(chat_id, reply, actions)
 
 @bot.message_handler(commands=["menu"])
+@instrumented("menu")
 def menu_cmd(message):
     bot.send_message(message.chat.id, get_str(message.chat.id, 'choose_opt'), reply_markup=menu_markup(message.chat.id), parse_mode="HTML")
 
+callback_answer_executor = ThreadPoolExecutor(max_workers=4)
+
+def answer_callback(call_id):
+    # Answered off the handler path, the handler's own reply doesn't wait on it
+    def answer():
+        try:
+            bot.answer_callback_query(call_id)
+        except Exception as e:
+            print(f"Callback answer error: {e}")
+            count_error("callback_answer")
+    callback_answer_executor.submit(answer)
+
+def show_in_place(call, text, reply_markup=None, parse_mode=None, disable_web_page_preview=None):
+    # Menu screens replace the message the button was on instead of sending a new one
+    chat_id = call.message.chat.id
+    try:
+        bot.edit_message_text(text, chat_id, call.message.message_id, reply_markup=reply_markup, parse_mode=parse_mode,
+                              disable_web_page_preview=disable_web_page_preview)
+    except ApiTelegramException as e:
+        if "message is not modified" in e.description:
+            return
+        bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode,
+                         disable_web_page_preview=disable_web_page_preview)
+
 @bot.callback_query_handler(func=lambda call: True)
+@instrumented("callback")
 def callback_router(call):
     data = call.data
     chat_id = call.message.chat.id
-    bot.answer_callback_query(call.id)
+    answer_callback(call.id)
     
     if data == "menu_lang":
-        language_cmd(call.message)
+        show_in_place(call, get_str(chat_id, 'lang_choose'), reply_markup=language_markup())
         return
 
     if data.startswith("rate_"):
         stars = int(data.split("_")[1])
+        # The user may have rated through another worker since the buttons were shown
+        if state_get('ratings', call.from_user.id) is not None:
+            bot.edit_message_text(get_str(chat_id, 'rate_already'), chat_id, call.message.message_id, reply_markup=back_to_menu_markup())
+            return
         bot_ratings[call.from_user.id] = stars
-        save_data()
+        state_set('ratings', call.from_user.id, stars)
         bot.edit_message_text(get_str(chat_id, 'rate_thanks').format(stars=stars), chat_id, call.message.message_id, reply_markup=back_to_menu_markup())
         return
 
@@ -392,10 +1797,13 @@ def callback_router(call):
     
     if data.startswith("lang_"):
         chat_languages[chat_id] = data.split("_")[1]
-        bot.send_message(chat_id, get_str(chat_id, 'lang_set'), reply_markup=menu_markup(chat_id))
+        state_set('chat_languages', chat_id, chat_languages[chat_id])
+        show_in_place(call, get_str(chat_id, 'lang_set'), reply_markup=menu_markup(chat_id))
         return
 
     if data == "menu_home" or data == "menu_help":
+        show_in_place(call, get_str(chat_id, 'help'), reply_markup=menu_markup(chat_id), parse_mode="HTML")
+    elif data == "menu_new":
         bot.send_message(chat_id, get_str(chat_id, 'help'), reply_markup=menu_markup(chat_id), parse_mode="HTML")
     elif data == "menu_latest":
         latest_cmd(call.message)
@@ -403,36 +1811,296 @@ def callback_router(call):
         picks = get_random_5(chat_id)
         send_entries(chat_id, picks, "RANDOM ANIME NEWS")
     elif data == "menu_ai":
-        bot.send_message(chat_id, get_str(chat_id, 'ai_usage'), parse_mode="HTML")
+        show_in_place(call, get_str(chat_id, 'ai_usage'), reply_markup=back_to_menu_markup(), parse_mode="HTML")
     elif data == "menu_about":
-        bot.send_message(chat_id, get_str(chat_id, 'about_text'), parse_mode="HTML", reply_markup=back_to_menu_markup())
+        show_in_place(call, get_str(chat_id, 'about_text'), reply_markup=back_to_menu_markup(), parse_mode="HTML")
+    elif data == "menu_search":
+        show_in_place(call, get_str(chat_id, 'search_usage'), reply_markup=back_to_menu_markup(), parse_mode="HTML")
+    elif data.startswith("search_"):
+        parts = data.split("_")
+        page = search_page(chat_id, parts[2], int(parts[1])) if len(parts) == 3 else None
+        if page:
+            show_in_place(call, page[0], reply_markup=page[1], parse_mode="HTML", disable_web_page_preview=True)
+        else:
+            # Expired search: keep the old results, explain how to search again
+            bot.send_message(chat_id, get_str(chat_id, 'search_usage'), reply_markup=back_to_menu_markup(in_place=False), parse_mode="HTML")
     elif data == "menu_ping":
         start_time = time.time()
         msg = bot.send_message(chat_id, "Pinging...")
         end_time = time.time()
         latency = round((end_time - start_time) * 1000)
-        bot.edit_message_text(get_str(chat_id, 'ping_text').format(ms=latency), chat_id, msg.message_id, parse_mode="HTML", reply_markup=back_to_menu_markup())
+        bot.edit_message_text(get_str(chat_id, 'ping_text').format(ms=latency), chat_id, msg.message_id, parse_mode="HTML", reply_markup=back_to_menu_markup(in_place=False))
     elif data == "menu_autoon":
         auto_update_chats.add(chat_id)
-        bot.send_message(chat_id, get_str(chat_id, 'auto_on'), reply_markup=back_to_menu_markup())
+        state_set('auto_update_chats', chat_id)
+        show_in_place(call, get_str(chat_id, 'auto_on'), reply_markup=back_to_menu_markup())
     elif data == "menu_autooff":
         auto_update_chats.discard(chat_id)
-        bot.send_message(chat_id, get_str(chat_id, 'auto_off'), reply_markup=back_to_menu_markup())
+        state_delete('auto_update_chats', chat_id)
+        show_in_place(call, get_str(chat_id, 'auto_off'), reply_markup=back_to_menu_markup())
+
+delivery_executor = ThreadPoolExecutor(max_workers=DELIVERY_WORKERS)
+
+def is_chat_gone(e):
+    # Blocked by the user, deactivated account, kicked from group or deleted chat
+    return e.error_code == 403 or (e.error_code == 400 and "chat not found" in e.description.lower())
+
+def render_update(entry, lang):
+    _, link = entry_title_link(entry)
+    return STRINGS[lang].get('new_update', STRINGS['en']['new_update']) + NL + "✅ " + html.escape(localized_title(entry, lang)) + NL + html.escape(link)
+
+def deliver_to_chat(chat_id, messages):
+    # Rate limits and retries are handled by the Telegram transport
+    for text in messages:
+        try:
+            bot.send_message(chat_id, text, parse_mode="HTML")
+        except ApiTelegramException as e:
+            if is_chat_gone(e):
+                auto_update_chats.discard(chat_id)
+                state_delete('auto_update_chats', chat_id)
+                print(f"Removed chat {chat_id} from auto updates: {e.description}")
+                inc_metric("animebot_autoupdate_pruned_total")
+                return
+            print(f"Auto update send error for {chat_id}: {e}")
+            count_error("delivery")
+        except Exception as e:
+            print(f"Auto update send error for {chat_id}: {e}")
+            count_error("delivery")
+
+def fan_out(entries):
+    # Render every new entry once per language, then let the pool deliver per chat
+    rendered = {lang: [render_update(entry, lang) for entry in entries] for lang in STRINGS}
+    futures = [
+        delivery_executor.submit(deliver_to_chat, chat_id, rendered[get_lang(chat_id)])
+        for chat_id in list(auto_update_chats)
+    ]
+    for future in futures:
+        future.result()
+
+    # Lag from the article's publish time to the last subscriber being served
+    delivered_at = time.time()
+    for entry in entries:
+        published = getattr(entry, "published_parsed", None)
+        if published:
+            observe_metric("animebot_autoupdate_lag_seconds", delivered_at - calendar.timegm(published), buckets=LAG_BUCKETS)
+    inc_metric("animebot_autoupdate_entries_total", len(entries))
 
 def auto_update_worker():
+    while not shutting_down.is_set():
+        try:
+            # Subscriptions and languages may have been changed by another worker
+            reload_shared_state()
+            # Poll even without subscribers so the seen index stays current
+            new_entries = poll_new_entries()
+            if new_entries:
+                translate_titles(new_entries, active_languages())
+            if new_entries and auto_update_chats:
+                fan_out(new_entries)
+        except Exception as e:
+            print(f"Auto update error: {e}")
+            count_error("auto_update")
+        shutting_down.wait(AUTO_UPDATE_INTERVAL_SEC)
+
+# Async runtime: AsyncTeleBot with aiohttp for RSS and the async OpenAI client,
+# so slow AI answers and feed fetches overlap on one event loop. Commands with
+# no slow I/O reuse the threaded handlers through asyncio.to_thread.
+abot = None
+async_openai_client = None
+aio_session = None
+async_feed_locks = {}
+
+async def async_fetch_feed(url):
+    cached = feed_cache.get(url)
+    if feed_is_fresh(cached, time.time()):
+        inc_metric("animebot_feed_cache_total", result="hit")
+        return cached['entries']
+
+    lock = async_feed_locks.setdefault(url, asyncio.Lock())
+    async with lock:
+        cached = feed_cache.get(url)
+        if feed_is_fresh(cached, time.time()):
+            return cached['entries']
+
+        try:
+            timeout = aiohttp.ClientTimeout(total=15)
+            with timed("animebot_rss_fetch_seconds", feed=url):
+                async with aio_session.get(url, headers=feed_request_headers(cached), timeout=timeout) as response:
+                    content = await response.read()
+            # Parsing is CPU bound, keep it off the event loop
+            entries = await asyncio.to_thread(store_feed_response, url, cached, response.status, content, response.headers)
+            if entries is not None:
+                return entries
+        except Exception as e:
+            print(f"Feed fetch error for {url}: {e}")
+            count_error("feed_fetch")
+        return serve_stale_feed(url, cached)
+
+async def async_fetch_entries():
+    feeds = await asyncio.gather(*(async_fetch_feed(url) for url in RSS_URLS))
+    if len(feeds) == 1:
+        return feeds[0]
+    return merge_feeds(feeds)
+
+async def async_send_entries(chat_id, entries, heading):
+    if not entries:
+        await abot.send_message(chat_id, get_str(chat_id, 'no_news'), disable_web_page_preview=False,
+                                reply_markup=back_to_menu_markup(in_place=False))
+        return
+
+    translate_in_background(entries, get_lang(chat_id))
+    await abot.send_message(chat_id, format_entries(entries, heading, get_lang(chat_id)), disable_web_page_preview=False, reply_markup=back_to_menu_markup(in_place=False), parse_mode="HTML")
+
+@instrumented("latest")
+async def async_latest_cmd(message):
+    entries = await async_fetch_entries()
+    if not entries:
+        await abot.reply_to(message, get_str(message.chat.id, 'no_news'), reply_markup=back_to_menu_markup(in_place=False))
+        return
+    await async_send_entries(message.chat.id, entries[:10], "LATEST ANIME NEWS")
+
+async def async_apply_reply_actions(chat_id, reply, actions):
+    for kind, text in actions:
+        if kind == "send":
+            reply.message_id = (await abot.send_message(chat_id, text)).message_id
+        elif kind == "edit":
+            await abot.edit_message_text(text, chat_id, reply.message_id)
+        else:
+            try:
+                await abot.edit_message_text(text, chat_id, reply.message_id)
+            except Exception as e:
+                print(f"AI edit skipped: {e}")
+
+async_ai_queue = None
+
+async def async_apply_flight_actions(flight_actions):
+    for chat_id, reply, actions in flight_actions:
+        try:
+            await async_apply_reply_actions(chat_id, reply, actions)
+        except Exception as e:
+            print(f"AI reply error for {chat_id}: {e}")
+            count_error("ai_reply")
+
+async def async_run_ai_flight(flight):
+    start = time.perf_counter()
+    try:
+        if AI_STREAMING:
+            stream = await async_openai_client.chat.completions.create(
+                model=AI_MODEL,
+                messages=ai_messages(flight.chat_id, flight.query),
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not flight.text:
+                        observe_metric("animebot_groq_first_token_seconds", time.perf_counter() - start)
+                    await async_apply_flight_actions(flight.feed(chunk.choices[0].delta.content))
+        else:
+            response = await async_openai_client.chat.completions.create(
+                model=AI_MODEL,
+                messages=ai_messages(flight.chat_id, flight.query)
+            )
+            await async_apply_flight_actions(flight.feed(str(response.choices[0].message.content or "Error"), progress=False))
+    except Exception as e:
+        print(f"AI Error: {e}")
+        count_error("ai")
+        flight.failed = True
+    observe_metric("animebot_groq_completion_seconds", time.perf_counter() - start)
+    await async_apply_flight_actions(flight.finish())
+
+async def async_ai_worker():
     while True:
+        flight = await async_ai_queue.get()
+        set_ai_active(1)
         try:
-            if auto_update_chats:
-                entries = fetch_entries()
-                if entries:
-                    title, link = entry_title_link(entries[0])
-                    for chat_id in list(auto_update_chats):
-                        if last_seen_link.get(chat_id) != link:
-                            last_seen_link[chat_id] = link
-                            bot.send_message(chat_id, f"🆕 <b>NEW RSS UPDATE!</b>{NL}✅ {title}{NL}{link}", parse_mode="HTML")
-        except Exception:
-            pass
-        time.sleep(AUTO_UPDATE_INTERVAL_SEC)
+            await async_run_ai_flight(flight)
+        finally:
+            set_ai_active(-1)
+
+@instrumented("ai")
+async def async_ai_cmd(message):
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2 or is_image_request(parts[1]):
+        await asyncio.to_thread(ai_cmd, message)
+        return
+
+    query = parts[1].strip()
+    chat_id = message.chat.id
+    cached = ai_cache_get(ai_request_key(chat_id, query))
+    if cached:
+        chunks = split_long_reply(cached)
+        await abot.reply_to(message, chunks[0])
+        for chunk in chunks[1:]:
+            await abot.send_message(chat_id, chunk)
+        return
+
+    if not ai_user_allowed(message.from_user.id):
+        await abot.reply_to(message, get_str(chat_id, 'ai_slow_down'))
+        return
+    if async_ai_queue.full():
+        await abot.reply_to(message, get_str(chat_id, 'ai_busy'))
+        return
+
+    position = ai_queue_position(async_ai_queue)
+    thinking = get_str(chat_id, 'ai_queued').format(pos=position) if position else get_str(chat_id, 'ai_thinking')
+    processing_msg = await abot.reply_to(message, thinking)
+    reply = StreamedReply(processing_msg.message_id)
+    scheduled, actions = schedule_ai_flight(async_ai_queue, chat_id, query, reply)
+    if not scheduled:
+        await abot.edit_message_text(get_str(chat_id, 'ai_busy'), chat_id, reply.message_id)
+        return
+    await async_apply_reply_actions(chat_id, reply, actions)
+
+@instrumented("callback")
+async def async_callback_router(call):
+    data = call.data
+    chat_id = call.message.chat.id
+
+    if data == "menu_latest":
+        await abot.answer_callback_query(call.id)
+        await async_latest_cmd(call.message)
+    elif data == "menu_random":
+        await abot.answer_callback_query(call.id)
+        picks = pick_random_5(chat_id, await async_fetch_entries())
+        await async_send_entries(chat_id, picks, "RANDOM ANIME NEWS")
+    else:
+        await asyncio.to_thread(callback_router, call)
+
+def threaded_handler(handler):
+    async def run(message):
+        await asyncio.to_thread(handler, message)
+    return run
+
+async def async_bot_main():
+    global abot, async_openai_client, aio_session, async_ai_queue
+    abot = AsyncTeleBot(BOT_TOKEN)
+    from openai import AsyncOpenAI
+    async_openai_client = AsyncOpenAI(
+        api_key=os.environ.get("GROQ_API_KEY"),
+        base_url=GROQ_BASE_URL
+    )
+    threaded_commands = {
+        "language": language_cmd,
+        "start": start_cmd,
+        "rate": rate_cmd,
+        "status": status_cmd,
+        "help": help_cmd,
+        "about": about_cmd,
+        "ping": ping_cmd,
+        "menu": menu_cmd,
+        "search": search_cmd
+    }
+    for command, handler in threaded_commands.items():
+        abot.register_message_handler(threaded_handler(handler), commands=[command])
+    abot.register_message_handler(async_latest_cmd, commands=["latest"])
+    abot.register_message_handler(async_ai_cmd, commands=["ai"])
+    abot.register_callback_query_handler(async_callback_router, func=lambda call: True)
+
+    async_ai_queue = asyncio.Queue(maxsize=AI_QUEUE_MAX)
+    ai_workers = [asyncio.create_task(async_ai_worker()) for _ in range(AI_CONCURRENCY)]
+
+    async with aiohttp.ClientSession() as session:
+        aio_session = session
+        await abot.infinity_polling(skip_pending=True)
 
 app = Flask(__name__)
 
@@ -440,14 +2108,224 @@ app = Flask(__name__)
 def index():
     return "Bot is running 24/7!"
 
+def metric_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+def render_metrics():
+    gauges = {
+        "animebot_ai_queue_depth": ai_queue.qsize() + (async_ai_queue.qsize() if async_ai_queue else 0),
+        "animebot_ai_active": ai_active,
+        "animebot_ai_in_flight": len(ai_flights),
+        "animebot_dispatch_queue_depth": sum(jobs.qsize() for jobs in dispatch_queues),
+        "animebot_image_backfill_queue_depth": image_backfill_queue.qsize(),
+        "animebot_state_pending_writes": len(pending_writes),
+        "animebot_autoupdate_subscribers": len(auto_update_chats),
+        "animebot_users": len(bot_users),
+        "animebot_archive_entries": archive_docs,
+        "animebot_ai_cache_entries": len(ai_cache),
+        "animebot_image_cache_entries": len(image_file_ids)
+    }
+    lines = []
+    for name, value in gauges.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+
+    lines.append("# TYPE animebot_ai_cache_total counter")
+    for result, value in ai_cache_stats.items():
+        lines.append(f'animebot_ai_cache_total{{result="{result}"}} {value}')
+
+    with metrics_lock:
+        counters = sorted(metric_counters.items())
+        histograms = sorted((key, dict(h, counts=list(h['counts']))) for key, h in metric_histograms.items())
+
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{metric_labels(labels)} {value}")
+    for (name, labels), histogram in histograms:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            cumulative += count
+            lines.append(f"{name}_bucket{metric_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{metric_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{metric_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{metric_labels(labels)} {histogram['count']}")
+    return NL.join(lines) + NL
+
+@app.route('/metrics')
+def metrics():
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+# Webhook dispatcher: every chat always maps to the same worker queue, so its
+# updates are handled in order while different chats run in parallel
+dispatch_queues = [queue.Queue(maxsize=DISPATCH_QUEUE_MAX) for _ in range(DISPATCH_WORKERS)]
+
+def update_chat_id(update):
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query and update.callback_query.message:
+        return update.callback_query.message.chat.id
+    return update.update_id
+
+def dispatch_update(update):
+    jobs = dispatch_queues[update_chat_id(update) % DISPATCH_WORKERS]
+    try:
+        jobs.put_nowait(update)
+        return True
+    except queue.Full:
+        return False
+
+def dispatch_worker(jobs):
+    while True:
+        update = jobs.get()
+        try:
+            bot.process_new_updates([update])
+        except Exception as e:
+            print(f"Update handling error: {e}")
+            count_error("update_handling")
+        finally:
+            jobs.task_done()
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    # Nothing consumes the dispatch queues in polling mode
+    if not WEBHOOK_URL:
+        return "", 404
+    if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return "", 403
+    update = types.Update.de_json(request.get_data(as_text=True))
+    if not dispatch_update(update):
+        # Backlogged: a non-2xx makes Telegram redeliver the update later
+        return "", 503
+    return "", 200
+
 def run_bot():
-    bot.infinity_polling(skip_pending=True)
+    if WEBHOOK_URL:
+        # Only skip the backlog on first registration; a new leader taking over
+        # must not lose the updates that queued up during the failover
+        first_registration = bot.get_webhook_info().url != WEBHOOK_URL
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, drop_pending_updates=first_registration)
+    elif BOT_RUNTIME == "async":
+        asyncio.run(async_bot_main())
+    else:
+        try:
+            bot.remove_webhook()
+        except Exception as e:
+            print(f"Could not remove webhook: {e}")
+        bot.infinity_polling(skip_pending=True)
+
+# Lifecycle: every process serves Flask, handles webhook updates and flushes its
+# own state. Exactly one process, the holder of an exclusive lock on
+# LEADER_LOCK_PATH, polls Telegram (or registers the webhook) and runs the
+# auto-update scheduler; the others keep retrying so one takes over if it dies
+LEADER_LOCK_PATH = os.environ.get("LEADER_LOCK_PATH", STATE_DB_PATH + ".lock")
+LEADER_RETRY_SEC = 5
+SHUTDOWN_GRACE_SEC = 20
+shutting_down = threading.Event()
+lifecycle_lock = threading.Lock()
+started = False
+leader_lock_file = None
+auto_update_thread = None
+previous_sigterm_handler = None
+
+def try_become_leader():
+    global leader_lock_file
+    lock_file = open(LEADER_LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    leader_lock_file = lock_file
+    return True
+
+def leader_elector():
+    global auto_update_thread
+    while not shutting_down.is_set():
+        if try_become_leader():
+            print(f"Process {os.getpid()} is the leader")
+            reload_seen_index()
+            auto_update_thread = threading.Thread(target=auto_update_worker, daemon=True)
+            auto_update_thread.start()
+            threading.Thread(target=run_bot, daemon=True).start()
+            return
+        shutting_down.wait(LEADER_RETRY_SEC)
+
+def start():
+    global started, previous_sigterm_handler
+    with lifecycle_lock:
+        if started:
+            return
+        started = True
+
+    threading.Thread(target=state_writer, daemon=True).start()
+    threading.Thread(target=leader_elector, daemon=True).start()
+    if IMAGE_CACHE_CHAT_ID:
+        threading.Thread(target=image_backfill_worker, daemon=True).start()
+    if WEBHOOK_URL:
+        for jobs in dispatch_queues:
+            threading.Thread(target=dispatch_worker, args=(jobs,), daemon=True).start()
+    if WEBHOOK_URL or BOT_RUNTIME != "async":
+        for _ in range(AI_CONCURRENCY):
+            threading.Thread(target=ai_worker, daemon=True).start()
+
+    # Signal handlers can only be installed from the main thread
+    if threading.current_thread() is threading.main_thread():
+        previous_sigterm_handler = signal.signal(signal.SIGTERM, handle_sigterm)
+
+def work_in_flight():
+    return (ai_active or ai_queue.qsize()
+            or any(jobs.unfinished_tasks for jobs in dispatch_queues))
+
+def drain(deadline):
+    # Let the current fan-out finish, then wait for handlers, AI replies and
+    # queued sends, giving up at the deadline
+    if auto_update_thread:
+        auto_update_thread.join(max(0, deadline - time.time()))
+    while work_in_flight() and time.time() < deadline:
+        time.sleep(0.1)
+    for executor in (delivery_executor, callback_answer_executor, translation_executor):
+        waiter = threading.Thread(target=executor.shutdown, daemon=True)
+        waiter.start()
+        waiter.join(max(0, deadline - time.time()))
+
+def shutdown():
+    with lifecycle_lock:
+        if shutting_down.is_set():
+            return
+        shutting_down.set()
+
+    print("Shutting down, draining in-flight work...")
+    if leader_lock_file and not WEBHOOK_URL and BOT_RUNTIME != "async":
+        bot.stop_polling()
+    drain(time.time() + SHUTDOWN_GRACE_SEC)
+    flush_state()
+    if leader_lock_file:
+        fcntl.flock(leader_lock_file, fcntl.LOCK_UN)
+        leader_lock_file.close()
+
+def handle_sigterm(signum, frame):
+    shutdown()
+    # Hand over to the server's own handler (gunicorn's graceful exit) if there is one
+    if callable(previous_sigterm_handler):
+        previous_sigterm_handler(signum, frame)
+    else:
+        raise SystemExit(0)
 
-# Start background workers immediately when the module is loaded
-# This ensures they run on Render/Gunicorn
-threading.Thread(target=auto_update_worker, daemon=True).start()
-threading.Thread(target=run_bot, daemon=True).start()
+# Gunicorn (main:app on Render) only imports the module, so start on import.
+# Tools that drive the bot themselves set ANIMEBOT_AUTOSTART=0 and call start()
+if os.environ.get("ANIMEBOT_AUTOSTART", "1") != "0":
+    start()
 
 if __name__ == "__main__":
     # Local execution support
+    start()
     app.run(host='0.0.0.0', port=8080)